@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BlogConfig(AppConfig):
     name = 'apps.blog'
     verbose_name = "博客文章"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,208 @@
+import time
+import logging
+import threading
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from utils.hyperloglog import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+UV_PRECISION = 10  # 每篇文章每天1KB，标准误差约3.25%
+FLUSH_BATCH_SIZE = 1000
+
+# 本进程累积过增量、还没有写回的文章id，以及上一次写回的时间
+_pending = set()
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _counter_key(field, article_id):
+    return 'article_counter:%s:%s' % (field, article_id)
+
+
+def record_visit(uid, path, article_id):
+    """记录一次文章访问，同一用户1分钟内重复访问不计pv，同一天内重复访问不计uv"""
+    increase_pv = 0
+    pv_key = 'pv:%s:%s' % (uid, path)
+    if not cache.get(pv_key):
+        increase_pv = 1
+        cache.set(pv_key, 1, 1*60)  # 1分钟有效
+
+    increase_uv = count_unique_visitor(uid, article_id)
+
+    if increase_pv or increase_uv:
+        incr_article_counter(article_id, pv=increase_pv, uv=increase_uv)
+
+
+def count_unique_visitor(uid, article_id):
+    """
+    每篇文章每天用一个HyperLogLog估计不重复访客数，缓存中只占固定的1KB，
+    不再为每个访客保存一个key，误差见utils.hyperloglog.HyperLogLog
+    :return: 本次访问使当天uv估计值增加的数目，重复访客为0
+    """
+    key = 'uv_hll:%s:%s' % (article_id, str(date.today()))
+    data = cache.get(key)
+    hll = HyperLogLog.from_bytes(data) if data else HyperLogLog(UV_PRECISION)
+    before = len(hll)
+    if not hll.add(uid):
+        return 0
+    increase = max(len(hll) - before, 0)
+
+    # 与其他worker在此期间写入的寄存器合并后再写回
+    data = cache.get(key)
+    if data:
+        hll.merge(HyperLogLog.from_bytes(data))
+    cache.set(key, hll.to_bytes(), 48*60*60)  # 保留到第二天结束
+    return increase
+
+
+def buffering_enabled():
+    """
+    缓存后端保证不淘汰计数器（见utils.mmap_cache.MmapCache的PINNED_KEY_PREFIXES），
+    并且能原子地取出计数时才在缓存中累积增量，否则缓存满时累积的访问量会被悄悄丢弃，此时每次访问直接更新数据库
+    """
+    is_pinned = getattr(cache, 'is_pinned', None)
+    return bool(is_pinned and is_pinned(_counter_key('pv', 0)) and hasattr(cache, 'pop'))
+
+
+def _update_article(article_id, deltas):
+    from .models import Article  # 避免循环引用
+    Article.objects.filter(pk=article_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items() if delta})
+
+
+def _add_to_counter(key, delta):
+    """把增量加到缓存的计数上，缓存中没有可用的槽时返回False"""
+    if cache.add(key, delta, None):
+        return True
+    try:
+        cache.incr(key, delta)
+        return True
+    except ValueError:
+        # 计数恰好在add和incr之间被取走写回，或者缓存中没有可用的槽
+        return cache.add(key, delta, None)
+
+
+def incr_article_counter(article_id, pv=0, uv=0):
+    """
+    将文章pv/uv的增量先记在缓存里，而不是每次访问都UPDATE文章行，
+    每个进程记下自己累积过增量的文章，每隔ARTICLE_COUNTER_FLUSH_INTERVAL秒只把这些文章的增量写回数据库
+    """
+    global _last_flush
+    deltas = {field: delta for field, delta in (('pv', pv), ('uv', uv)) if delta}
+    if not buffering_enabled():
+        _update_article(article_id, deltas)
+        return
+
+    unbuffered = {field: delta for field, delta in deltas.items()
+                  if not _add_to_counter(_counter_key(field, article_id), delta)}
+    if unbuffered:
+        _update_article(article_id, unbuffered)
+
+    with _pending_lock:
+        if len(unbuffered) < len(deltas):
+            _pending.add(article_id)
+        now = time.monotonic()
+        due = now - _last_flush >= settings.ARTICLE_COUNTER_FLUSH_INTERVAL
+        if due:
+            _last_flush = now
+    if due:
+        try:
+            flush_pending_counters()
+        except Exception:
+            # 增量仍在缓存中，下一次写回，不影响本次访问
+            logger.exception('flush article counters failed')
+
+
+def _scan_article_ids():
+    """按id分批返回所有文章的id"""
+    from .models import Article  # 避免循环引用
+
+    last_id = 0
+    while True:
+        ids = list(Article.objects.filter(pk__gt=last_id).order_by('pk').values_list(
+            'pk', flat=True)[:FLUSH_BATCH_SIZE])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def _take_counters(article_ids):
+    """从缓存中取出这些文章累积的增量，取出后其他进程新增的访问会重新开始累积"""
+    keys = {_counter_key(field, article_id): (article_id, field)
+            for article_id in article_ids for field in ('pv', 'uv')}
+    taken = {}
+    for key in cache.get_many(keys):
+        value = cache.pop(key, 0)
+        if value:
+            article_id, field = keys[key]
+            taken.setdefault(article_id, {})[field] = value
+    return taken
+
+
+def _restore_counters(taken):
+    """写回失败时把取出的增量加回缓存，留到下一次写回"""
+    for article_id, deltas in taken.items():
+        for field, delta in deltas.items():
+            if not _add_to_counter(_counter_key(field, article_id), delta):
+                logger.error('lost %s %s of article %s, the cache is full', delta, field, article_id)
+        with _pending_lock:
+            _pending.add(article_id)
+
+
+def flush_article_counters(article_ids=None):
+    """
+    把缓存中累积的增量按文章合并，每篇文章只执行一条UPDATE写回数据库
+    增量先从缓存中原子地取出再写入，多个进程同时写回时不会重复计数，写入失败时加回缓存
+    需要在事务外调用，外层事务回滚时已取出的增量无法恢复
+    :param article_ids: 要写回的文章id，为None时分批扫描所有文章，
+        用于flush_article_counters命令定期写回没有正常退出的进程留下的增量
+    :return: 写回的文章数目
+    """
+    if not buffering_enabled():
+        return 0
+    if transaction.get_connection().in_atomic_block:
+        raise transaction.TransactionManagementError('flush_article_counters cannot run inside a transaction')
+
+    if article_ids is None:
+        batches = _scan_article_ids()
+    else:
+        article_ids = list(article_ids)
+        batches = (article_ids[i:i + FLUSH_BATCH_SIZE] for i in range(0, len(article_ids), FLUSH_BATCH_SIZE))
+
+    flushed = 0
+    for ids in batches:
+        taken = _take_counters(ids)
+        try:
+            with transaction.atomic():
+                for article_id, deltas in taken.items():
+                    _update_article(article_id, deltas)
+        except Exception:
+            _restore_counters(taken)
+            raise
+        flushed += len(taken)
+    return flushed
+
+
+def flush_pending_counters():
+    """写回本进程累积过增量的文章，在事务中调用时推迟到下一次"""
+    if transaction.get_connection().in_atomic_block:
+        return 0
+    with _pending_lock:
+        article_ids = list(_pending)
+        _pending.clear()
+    return flush_article_counters(article_ids)
+
+
+def flush_on_exit():
+    """在wsgi/asgi入口用atexit注册，worker正常退出时把还没写回的增量写入数据库"""
+    try:
+        flush_pending_counters()
+    except Exception:
+        logger.exception('flush article counters failed')
@@ -1,7 +1,10 @@
 import django_filters
+from django.core.cache import cache
 from django.db.models import Q
 from django import forms
 from .models import Article, Category, Tag
+from .search import search
+from utils.cache_version import get_cache_version
 
 
 class ArticleFilter(django_filters.FilterSet):
@@ -18,12 +21,29 @@ class ArticleFilter(django_filters.FilterSet):
         model = Article
         fields = {}
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 下拉框选项从缓存读取，渲染表单时不再查询所有分类和标签，分类或标签变化后缓存失效
+        for name, version_name in (('category', 'category'), ('tag', 'tag')):
+            field = self.filters[name].field
+            # django-filter的choices setter会重新包装成查询queryset的迭代器，这里直接赋值
+            field._choices = field.widget.choices = self.get_cached_choices(name, field, version_name)
+
+    @staticmethod
+    def get_cached_choices(name, field, version_name):
+        version = get_cache_version(version_name)
+        key = 'filter_choices:%s' % name
+        choices = cache.get(key, version=version)
+        if choices is None:
+            choices = [('', field.empty_label)] + [(obj.pk, field.label_from_instance(obj)) for obj in field.queryset]
+            cache.set(key, choices, version=version)
+        return choices
+
     def key_custom_filter(self, queryset, name, value):
-        return Article.objects.filter(is_published=True).filter(
-            Q(title__icontains=value) | Q(desc__icontains=value) | Q(content__icontains=value)
-        )
+        # 使用倒排索引检索，结果按相关度排序
+        return search(queryset, value)
 
     def category_custom_filter(self, queryset, name, value):
-        return Article.objects.filter(is_published=True).filter(
+        return queryset.filter(
             Q(category_id__exact=value) | Q(category__parent_category_id__exact=value)
         )
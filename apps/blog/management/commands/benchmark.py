@@ -0,0 +1,191 @@
+import os
+import re
+import json
+import math
+import time
+import platform
+import tempfile
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, get_resolver
+from django.utils import timezone
+
+from apps.blog.models import Article
+from apps.blog.sitemap import ArticleSitemap
+
+# 不测试的url：后台管理、第三方应用和上传文件
+SKIP_PREFIXES = ('admin/', 'accounts/', 'mdeditor/', '^media/')
+# 只接受POST的视图，用GET测试没有意义
+POST_ONLY_NAMES = ('add-comment',)
+# 缓存位置是文件的后端，--cold时换成临时文件，不清空同一台机器上运行的网站的缓存
+FILE_CACHE_BACKENDS = ('utils.mmap_cache.MmapCache', 'django.core.cache.backends.filebased.FileBasedCache')
+# 本来就是每个进程单独的缓存
+PROCESS_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',
+                          'django.core.cache.backends.dummy.DummyCache')
+
+
+def percentile(values, percent):
+    """最近秩法计算百分位数"""
+    values = sorted(values)
+    index = max(math.ceil(percent / 100 * len(values)) - 1, 0)
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = "用测试客户端逐个访问django_blog/urls.py中的页面，统计响应时间的p50/p95/p99、SQL查询数和响应大小，结果保存为JSON，可与上一次的结果比较"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help="每个页面测试的请求数，默认50")
+        parser.add_argument('--warmup', type=int, default=3, help="正式测试前预热的请求数，默认3")
+        parser.add_argument('--cold', action='store_true',
+                            help="每次请求前清空缓存，测试缓存未命中时的性能，mmap或文件缓存会换成临时文件")
+        parser.add_argument('--user', help="以该用户名登录后测试，默认匿名访问")
+        parser.add_argument('--output', default='benchmark.json', help="结果文件，默认benchmark.json")
+        parser.add_argument('--compare', help="与之前保存的结果文件比较")
+        parser.add_argument('--filter', help="只测试名称或url包含该字符串的页面")
+
+    def handle(self, *args, **options):
+        client = Client()
+        if options['user']:
+            try:
+                client.force_login(get_user_model().objects.get(username=options['user']))
+            except get_user_model().DoesNotExist:
+                raise CommandError('用户%s不存在' % options['user'])
+
+        targets = self.get_targets()
+        if options['filter']:
+            targets = [(name, url) for name, url in targets if options['filter'] in name or options['filter'] in url]
+        if not targets:
+            raise CommandError('没有可以测试的页面')
+
+        results = {}
+        with ExitStack() as stack:
+            stack.enter_context(override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']))
+            if options['cold']:
+                directory = stack.enter_context(tempfile.TemporaryDirectory())
+                stack.enter_context(override_settings(CACHES=self.get_cold_caches(directory)))
+            for name, url in targets:
+                results[name] = result = self.run(client, url, options)
+                line = '%-24s %-40s p50=%7.2fms p95=%7.2fms p99=%7.2fms queries=%-4d bytes=%d' % (
+                    name, url, result['p50'], result['p95'], result['p99'], result['queries'], result['bytes'])
+                # 非200的响应（404、重定向、错误页）的耗时没有参考意义
+                if result['status'] != [200]:
+                    line = self.style.ERROR('%s status=%s' % (line, ','.join(map(str, result['status']))))
+                self.stdout.write(line)
+
+        report = {
+            'meta': {
+                'time': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'cache': settings.CACHES['default']['BACKEND'],
+                'articles': Article.objects.count(),
+                'requests': options['requests'],
+                'cold': options['cold'],
+                'user': options['user'],
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS('结果已保存到%s' % options['output']))
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                self.compare(json.load(f), report)
+
+    def get_targets(self):
+        """
+        遍历根url配置中的页面，用数据库中已有的对象填充url参数
+        :return: [(名称, url), ...]
+        """
+        article = Article.objects.filter(is_published=True).order_by('-pv').only(
+            'id', 'author_id', 'category_id').first()
+        if article is None:
+            raise CommandError('没有已发布的文章，请先运行seed_benchmark_data生成测试数据')
+        kwargs = {'article_id': article.id, 'user_id': article.author_id, 'category_id': article.category_id,
+                  'tag_id': article.tag.values_list('id', flat=True).first() or 0, 'page': 1}
+        skip_names = set(POST_ONLY_NAMES)
+        # 文章数不超过单个sitemap文件的上限时没有分片，sitemap-1.xml是404
+        if ArticleSitemap().paginator.num_pages <= 1:
+            skip_names.add('sitemap-shard')
+
+        targets = []
+        for pattern in get_resolver().url_patterns:
+            route = str(pattern.pattern)
+            if not isinstance(pattern, URLPattern) or route.startswith(SKIP_PREFIXES) or pattern.name in skip_names:
+                continue
+            # 把<int:article_id>这样的参数替换成实际的值
+            url = '/' + re.sub(r'<(?:\w+:)?(\w+)>', lambda match: str(kwargs[match.group(1)]), route)
+            targets.append((pattern.name or route, url))
+        # 列表页的常见查询
+        targets.append(('article-list:page-2', '/?page=2'))
+        targets.append(('article-list:search', '/?key=Django'))
+        return targets
+
+    def get_cold_caches(self, directory):
+        """--cold时使用的缓存配置，只清空本进程使用的缓存"""
+        config = dict(settings.CACHES['default'])
+        if config['BACKEND'] in FILE_CACHE_BACKENDS:
+            config['LOCATION'] = os.path.join(directory, 'cache')
+        elif config['BACKEND'] not in PROCESS_CACHE_BACKENDS:
+            self.stderr.write(self.style.WARNING(
+                '%s是共享的缓存，--cold会在每次请求前清空它，使用同一个缓存的网站的缓存也会被清空' % config['BACKEND']))
+        return dict(settings.CACHES, default=config)
+
+    def run(self, client, url, options):
+        for i in range(options['warmup']):
+            client.get(url)
+
+        timings = []
+        queries = []
+        sizes = []
+        statuses = set()
+        for i in range(max(options['requests'], 1)):
+            if options['cold']:
+                cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = client.get(url)
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(context.captured_queries))
+            sizes.append(len(content))
+            statuses.add(response.status_code)
+
+        return {
+            'url': url,
+            'status': sorted(statuses),
+            'p50': round(percentile(timings, 50), 3),
+            'p95': round(percentile(timings, 95), 3),
+            'p99': round(percentile(timings, 99), 3),
+            'mean': round(sum(timings) / len(timings), 3),
+            'queries': max(queries),
+            'bytes': max(sizes),
+        }
+
+    def compare(self, old, new):
+        self.stdout.write('\n与%s的结果比较：' % old['meta']['time'])
+        for name, result in new['results'].items():
+            before = old['results'].get(name)
+            if before is None:
+                self.stdout.write('%-24s 新增' % name)
+                continue
+            changes = []
+            for key in ('p50', 'p95', 'p99', 'queries', 'bytes'):
+                if before[key]:
+                    changes.append('%s %+.1f%%' % (key, (result[key] - before[key]) / before[key] * 100))
+                else:
+                    changes.append('%s %s→%s' % (key, before[key], result[key]))
+            line = '%-24s %s' % (name, '  '.join(changes))
+            # p95变慢超过10%时标红
+            if before['p95'] and result['p95'] > before['p95'] * 1.1:
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
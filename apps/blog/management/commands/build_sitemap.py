@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.blog.sitemap import build_sitemap
+
+
+class Command(BaseCommand):
+    help = "重新生成sitemap文件，文章超过50000篇时分片并生成sitemap index"
+
+    def handle(self, *args, **options):
+        pages = build_sitemap()
+        self.stdout.write(self.style.SUCCESS('已生成%d个sitemap文件' % pages))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.blog.counters import flush_article_counters
+
+
+class Command(BaseCommand):
+    help = "扫描所有文章，将缓存中累积的pv/uv增量写回数据库，可以用cron定期执行，写回没有正常退出的进程留下的增量"
+
+    def handle(self, *args, **options):
+        flushed = flush_article_counters()
+        self.stdout.write(self.style.SUCCESS('已写回%d篇文章的访问计数' % flushed))
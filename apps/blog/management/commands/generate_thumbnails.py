@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.config.models import BlogSettings
+from apps.users.models import UserProfile
+from utils.images import generate_avatar_variants, generate_background_variants
+from utils.cache_version import bump_cache_version
+
+
+class Command(BaseCommand):
+    help = "为已上传的用户头像和背景图片生成缩略图"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="重新生成已存在的缩略图")
+
+    def handle(self, *args, **options):
+        count = 0
+        # 多个用户可能使用同一个默认头像
+        for name in UserProfile.objects.exclude(image='').values_list('image', flat=True).distinct():
+            count += generate_avatar_variants(UserProfile(image=name).image, force=options['force'])
+        for blog_setting in BlogSettings.objects.exclude(background_image='').exclude(background_image=None):
+            count += generate_background_variants(blog_setting.background_image, force=options['force'])
+        # 网站配置中背景图片的url改为缩略图
+        bump_cache_version('blog_setting')
+        self.stdout.write(self.style.SUCCESS('生成%d个缩略图' % count))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.blog.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "清空并重建文章全文检索索引"
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS('已为%d篇文章重建检索索引' % count))
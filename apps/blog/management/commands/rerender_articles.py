@@ -0,0 +1,65 @@
+import os
+import time
+from functools import partial
+from multiprocessing import Pool
+
+import django
+import mistune
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from apps.blog.models import Article
+from utils.blog_setting import get_blog_setting
+from utils.cache_version import bump_cache_version
+
+
+def render_rows(rows, sub_length):
+    """在子进程中渲染，只做Markdown转换和截取摘录，不访问数据库"""
+    result = []
+    for pk, content in rows:
+        content_html = mistune.markdown(content)
+        excerpt = Article.make_excerpt(content_html, sub_length)
+        result.append((pk, content_html, Article.get_content_hash(content), excerpt))
+    return result
+
+
+class Command(BaseCommand):
+    help = "使用进程池重新渲染所有文章的content_html和摘录，用于升级Markdown渲染器后批量更新"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help="进程数，默认为CPU核数")
+        parser.add_argument('--batch-size', type=int, default=100, help="每个进程每次渲染的文章数")
+
+    def handle(self, *args, **options):
+        processes = max(options['processes'], 1)
+        batch_size = max(options['batch_size'], 1)
+        sub_length = get_blog_setting()['article_sub_length']
+        ids = list(Article.objects.order_by('id').values_list('id', flat=True))
+        total = len(ids)
+        done = 0
+        start = time.time()
+
+        # 子进程不能继承父进程的数据库连接
+        connections.close_all()
+        # spawn、forkserver方式启动的子进程不会继承已经初始化的Django，需要重新setup后才能导入模型
+        with Pool(processes, initializer=django.setup) as pool:
+            step = batch_size * processes
+            for i in range(0, total, step):
+                rows = list(Article.objects.filter(id__in=ids[i:i + step]).values_list('id', 'content'))
+                chunks = [rows[j:j + batch_size] for j in range(0, len(rows), batch_size)]
+                articles = [
+                    Article(id=pk, content_html=content_html, content_hash=content_hash, excerpt=excerpt)
+                    for rendered in pool.map(partial(render_rows, sub_length=sub_length), chunks)
+                    for pk, content_html, content_hash, excerpt in rendered
+                ]
+                Article.objects.bulk_update(articles, ['content_html', 'content_hash', 'excerpt'],
+                                            batch_size=batch_size)
+                done += len(articles)
+                elapsed = time.time() - start
+                self.stdout.write('%d/%d  %.1f篇/秒' % (done, total, done / elapsed if elapsed else 0))
+
+        # bulk_update不会触发post_save，手动使依赖文章的缓存失效
+        bump_cache_version('article')
+        elapsed = time.time() - start
+        self.stdout.write(self.style.SUCCESS('重新渲染%d篇文章，用时%.1f秒，%.1f篇/秒' % (
+            done, elapsed, done / elapsed if elapsed else 0)))
@@ -0,0 +1,182 @@
+import random
+import datetime
+
+import mistune
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from apps.blog.models import Article, Category, Tag
+from apps.blog.search import rebuild_index
+from apps.comment.models import Comment
+from utils.blog_setting import get_blog_setting
+from utils.cache_version import bump_cache_version
+
+WORDS = (
+    'Django', 'Python', 'MySQL', '缓存', '索引', '查询', '性能', '并发', '数据库', '模板', '中间件', '分页',
+    '部署', 'Nginx', 'uwsgi', 'Redis', '事务', '锁', '进程', '线程', '异步', '队列', '日志', '监控',
+    'HTTP', '压缩', '静态文件', '算法', '复杂度', '内存', '磁盘', '网络', '延迟', '吞吐量', '优化', '测试',
+)
+
+
+def max_pk(model):
+    return model.objects.aggregate(pk=Max('pk'))['pk'] or 0
+
+
+class Command(BaseCommand):
+    help = "生成用于性能测试的大规模模拟数据：用户、三级分类、标签、文章（含标签）和多级评论"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type=int, default=50000, help="文章数，默认50000")
+        parser.add_argument('--comments', type=int, default=500000, help="评论数，默认500000")
+        parser.add_argument('--tags', type=int, default=1000, help="标签数，默认1000")
+        parser.add_argument('--users', type=int, default=200, help="用户数，默认200")
+        parser.add_argument('--categories', default='5,5,4',
+                            help="每一级分类的子分类数，用逗号分隔，默认5,5,4即5个一级分类、每个下5个二级、再各4个三级")
+        parser.add_argument('--reply-ratio', type=float, default=0.4, help="评论中回复其他评论的比例，默认0.4")
+        parser.add_argument('--days', type=int, default=5 * 365, help="文章发布时间分布在最近多少天内，默认5年")
+        parser.add_argument('--batch-size', type=int, default=2000, help="每次批量插入的行数")
+        parser.add_argument('--seed', type=int, default=0, help="随机数种子，相同的种子生成相同的数据")
+        parser.add_argument('--search-index', action='store_true', help="生成数据后重建全文检索索引")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = max(options['batch_size'], 1)
+        try:
+            widths = [int(width) for width in options['categories'].split(',')]
+        except ValueError:
+            raise CommandError('--categories的格式应为逗号分隔的整数，如5,5,4')
+        if options['users'] < 1 or not widths or min(widths) < 1:
+            raise CommandError('至少需要一个用户和一个分类')
+
+        # 主键直接从现有最大值之后分配，批量插入后无需再查询新行的主键
+        with transaction.atomic():
+            user_ids = self.create_users(options['users'])
+            leaf_ids = self.create_categories(widths, user_ids)
+            tag_ids = self.create_tags(options['tags'], user_ids)
+            article_ids = self.create_articles(options['articles'], options['days'], leaf_ids, tag_ids, user_ids)
+            self.create_comments(options['comments'], options['reply_ratio'], article_ids, user_ids)
+
+        # 批量插入不会触发post_save，手动使相关缓存失效
+        for name in ('category', 'tag', 'article', 'comment'):
+            bump_cache_version(name)
+
+        if options['search_index']:
+            self.stdout.write('重建全文检索索引……')
+            rebuild_index()
+        self.stdout.write(self.style.SUCCESS('模拟数据生成完成'))
+
+    def bulk_create(self, model, objs):
+        model.objects.bulk_create(objs)
+        self.stdout.write('%s：%d' % (model._meta.verbose_name, len(objs)))
+
+    def create_users(self, count):
+        start = max_pk(get_user_model()) + 1
+        password = make_password('password')
+        users = [
+            get_user_model()(id=pk, username='bench_user_%d' % pk, email='bench_user_%d@example.com' % pk,
+                             nickname='测试用户%d' % pk, password=password)
+            for pk in range(start, start + count)
+        ]
+        self.bulk_create(get_user_model(), users)
+        return [user.id for user in users]
+
+    def create_categories(self, widths, user_ids):
+        """按层生成分类树，返回最底层分类的主键"""
+        pk = max_pk(Category)
+        categories = []
+        parents = [None]
+        for level, width in enumerate(widths):
+            children = []
+            for parent in parents:
+                for i in range(width):
+                    pk += 1
+                    name = '分类%d' % (i + 1) if parent is None else '%s-%d' % (parent.name, i + 1)
+                    children.append(Category(id=pk, name=name, parent_category=parent, sort=i + 1,
+                                             is_nav=level == 0, owner_id=self.rng.choice(user_ids)))
+            categories.extend(children)
+            parents = children
+        self.bulk_create(Category, categories)
+        return [category.id for category in parents]
+
+    def create_tags(self, count, user_ids):
+        start = max_pk(Tag) + 1
+        tags = [Tag(id=pk, name='标签%d' % pk, owner_id=self.rng.choice(user_ids)) for pk in range(start, start + count)]
+        self.bulk_create(Tag, tags)
+        return [tag.id for tag in tags]
+
+    def make_content(self):
+        rng = self.rng
+
+        def sentence():
+            return ''.join(rng.choice(WORDS) for _ in range(rng.randint(5, 15))) + '。'
+
+        parts = []
+        for i in range(rng.randint(2, 6)):
+            parts.append('## %s' % ''.join(rng.sample(WORDS, 3)))
+            parts.append(''.join(sentence() for _ in range(rng.randint(2, 8))))
+            if rng.random() < 0.3:
+                parts.append('\n'.join('- %s' % sentence() for _ in range(rng.randint(2, 5))))
+            if rng.random() < 0.3:
+                parts.append('```python\nfor i in range(%d):\n    print(i)\n```' % rng.randint(1, 100))
+        return '\n\n'.join(parts)
+
+    def create_articles(self, count, days, category_ids, tag_ids, user_ids):
+        rng = self.rng
+        start = max_pk(Article) + 1
+        sub_length = get_blog_setting()['article_sub_length']
+        now = timezone.now()
+        # 标签的使用频率近似Zipf分布，少数标签对应大量文章
+        tag_weights = [1 / (i + 1) for i in range(len(tag_ids))]
+        Through = Article.tag.through
+        ids = []
+        for batch_start in range(start, start + count, self.batch_size):
+            articles = []
+            relations = []
+            for pk in range(batch_start, min(batch_start + self.batch_size, start + count)):
+                content = self.make_content()
+                content_html = mistune.markdown(content)
+                is_published = rng.random() < 0.95
+                articles.append(Article(
+                    id=pk, title='%s%d' % (''.join(rng.sample(WORDS, 3)), pk), desc=''.join(rng.sample(WORDS, 5)),
+                    content=content, content_html=content_html, content_hash=Article.get_content_hash(content),
+                    excerpt=Article.make_excerpt(content_html, sub_length), category_id=rng.choice(category_ids),
+                    author_id=rng.choice(user_ids), is_published=is_published,
+                    on_top=is_published and rng.random() < 0.001,
+                    pub_time=now - datetime.timedelta(seconds=rng.randint(0, days * 86400)) if is_published else None,
+                    pv=rng.randint(0, 10000), uv=rng.randint(0, 5000),
+                ))
+                if tag_ids:
+                    for tag_id in set(rng.choices(tag_ids, tag_weights, k=rng.randint(1, 5))):
+                        relations.append(Through(article_id=pk, tag_id=tag_id))
+            Article.objects.bulk_create(articles)
+            Through.objects.bulk_create(relations)
+            ids.extend(article.id for article in articles)
+            self.stdout.write('%s：%d/%d' % (Article._meta.verbose_name, len(ids), count))
+        return ids
+
+    def create_comments(self, count, reply_ratio, article_ids, user_ids):
+        if not article_ids:
+            return
+        rng = self.rng
+        start = max_pk(Comment) + 1
+        # 每篇文章已生成的评论，回复只会指向同一篇文章中更早的评论
+        article_comments = {}
+        comments = []
+        for pk in range(start, start + count):
+            article_id = rng.choice(article_ids)
+            siblings = article_comments.setdefault(article_id, [])
+            parent_id = rng.choice(siblings) if siblings and rng.random() < reply_ratio else None
+            siblings.append(pk)
+            comments.append(Comment(id=pk, article_id=article_id, parent_comment_id=parent_id,
+                                    content=''.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30))),
+                                    author_id=rng.choice(user_ids), is_deleted=rng.random() < 0.02))
+            if len(comments) >= self.batch_size:
+                Comment.objects.bulk_create(comments)
+                comments = []
+                self.stdout.write('%s：%d/%d' % (Comment._meta.verbose_name, pk - start + 1, count))
+        Comment.objects.bulk_create(comments)
+        self.stdout.write('%s：%d' % (Comment._meta.verbose_name, count))
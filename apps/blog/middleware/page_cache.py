@@ -0,0 +1,85 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import resolve, Resolver404
+from django.utils.cache import get_conditional_response
+from django.utils.http import urlencode, parse_http_date_safe
+
+from apps.blog.counters import record_visit
+from utils.cache_version import get_cache_versions
+
+# 可以整页缓存的页面
+CACHEABLE_URL_NAMES = ('article-list', 'article-detail', 'article-archives', 'comment-threads')
+# 页面内容依赖的数据，对应的模型保存或删除后缓存的页面全部失效
+PAGE_DEPENDENCIES = ('article', 'comment', 'category', 'tag', 'link', 'sidebar', 'blog_setting')
+
+
+class PageCacheMiddleware:
+    """
+    匿名用户GET请求的整页缓存，缓存键由路径、规范化后的查询参数和站点内容版本号组成，
+    需要放在AuthenticationMiddleware和UserIDMiddleware之后
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        match = self.match(request)
+        if match is None:
+            return self.get_response(request)
+
+        key = self.get_cache_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            # 缓存命中时视图不会执行，在这里记录文章访问
+            if match.url_name == 'article-detail':
+                record_visit(request.uid, request.path, match.kwargs['article_id'])
+            return self.restore(request, entry)
+
+        response = self.get_response(request)
+        if request.method == 'GET' and self.should_cache(response):
+            cache.set(key, self.serialize(response), settings.PAGE_CACHE_TIMEOUT)
+        return response
+
+    def match(self, request):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        return match if match.url_name in CACHEABLE_URL_NAMES else None
+
+    def get_cache_key(self, request):
+        # 去掉空的查询参数并排序，使参数顺序不同的同一页面共用缓存
+        params = sorted((k, v) for k, values in request.GET.lists() for v in values if v)
+        url = '%s?%s' % (request.path, urlencode(params))
+        return 'page:%s:%s' % (hashlib.md5(url.encode('utf-8')).hexdigest(), get_cache_versions(*PAGE_DEPENDENCIES))
+
+    def should_cache(self, response):
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and 'private' not in response.get('Cache-Control', '')
+        )
+
+    def serialize(self, response):
+        return {
+            'content': response.content,
+            'headers': list(response.items()),
+        }
+
+    def restore(self, request, entry):
+        response = HttpResponse(entry['content'])
+        for header, value in entry['headers']:
+            response[header] = value
+        last_modified = response.get('Last-Modified')
+        return get_conditional_response(
+            request,
+            etag=response.get('ETag'),
+            last_modified=parse_http_date_safe(last_modified) if last_modified else None,
+            response=response,
+        )
@@ -0,0 +1,165 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+# 慢请求记录在缓存中的键
+SLOW_REQUESTS_KEY = 'slow_requests'
+# 一天内没有新的慢请求时清空记录，早已修复的慢请求不会一直占着列表
+SLOW_REQUESTS_TIMEOUT = 24 * 60 * 60
+_MISSING = object()
+
+
+class RequestTimings:
+    """一个请求中各部分的耗时（毫秒）和次数"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.total = 0.0
+        self.view_start = None
+        self.view = None
+        self.render = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @staticmethod
+    def elapsed(start):
+        return (time.perf_counter() - start) * 1000
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += self.elapsed(start)
+            self.sql_count += 1
+
+    def header(self):
+        metrics = ['total;dur=%.1f' % self.total]
+        if self.view is not None:
+            metrics.append('view;dur=%.1f' % self.view)
+        if self.render is not None:
+            metrics.append('render;dur=%.1f' % self.render)
+        metrics.append('sql;dur=%.1f;desc="%d queries"' % (self.sql_time, self.sql_count))
+        metrics.append('cache;desc="%d hits %d misses"' % (self.cache_hits, self.cache_misses))
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        return {
+            'total': round(self.total, 1),
+            'view': None if self.view is None else round(self.view, 1),
+            'render': None if self.render is None else round(self.render, 1),
+            'sql_count': self.sql_count,
+            'sql_time': round(self.sql_time, 1),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+class ServerTimingMiddleware:
+    """
+    统计每个请求的SQL查询数和耗时、缓存命中和未命中次数、视图和模板渲染耗时，
+    通过Server-Timing响应头返回（浏览器开发者工具的Timing面板中可以看到），
+    超过SLOW_REQUEST_THRESHOLD毫秒的请求记录到缓存中，只保留最慢的SLOW_REQUEST_LOG_SIZE条，在后台首页的“慢请求”中查看
+    需要在settings中设置SERVER_TIMING = True开启，放在MIDDLEWARE的第一个，使统计的总耗时包含其他中间件
+    """
+
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = request.server_timings = RequestTimings()
+        backend = caches['default']
+        self.instrument_cache(backend, timings)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.sql_wrapper))
+                response = self.get_response(request)
+        finally:
+            # 缓存实例是每个线程一个的，请求结束后恢复原来的方法
+            backend.__dict__.pop('get', None)
+            backend.__dict__.pop('get_many', None)
+
+        timings.total = timings.elapsed(timings.start)
+        if timings.view is None and timings.view_start is not None:
+            # 不是TemplateResponse的视图，模板在视图中渲染，耗时算在视图中
+            timings.view = timings.elapsed(timings.view_start)
+        response['Server-Timing'] = timings.header()
+        if timings.total >= settings.SLOW_REQUEST_THRESHOLD:
+            self.log_slow_request(request, response, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.server_timings.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # 本中间件排在第一个，它的process_template_response最后执行，之后马上开始渲染模板
+        timings = request.server_timings
+        if timings.view_start is not None:
+            timings.view = timings.elapsed(timings.view_start)
+        render_start = time.perf_counter()
+
+        def rendered(response):
+            timings.render = timings.elapsed(render_start)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def instrument_cache(backend, timings):
+        get, get_many = backend.get, backend.get_many
+        # 部分缓存后端的get_many由多次get实现，避免重复统计
+        state = {'in_many': False}
+
+        def counted_get(key, default=None, version=None):
+            value = get(key, _MISSING, version=version)
+            if not state['in_many']:
+                if value is _MISSING:
+                    timings.cache_misses += 1
+                else:
+                    timings.cache_hits += 1
+            return default if value is _MISSING else value
+
+        def counted_get_many(keys, version=None):
+            keys = list(keys)
+            state['in_many'] = True
+            try:
+                values = get_many(keys, version=version)
+            finally:
+                state['in_many'] = False
+            timings.cache_hits += len(values)
+            timings.cache_misses += len(keys) - len(values)
+            return values
+
+        backend.get = counted_get
+        backend.get_many = counted_get_many
+
+    @staticmethod
+    def log_slow_request(request, response, timings):
+        entry = timings.as_dict()
+        entry.update({
+            'time': timezone.now(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'user': request.user.get_username() if getattr(request, 'user', None) else '',
+        })
+        # 只保留最慢的SLOW_REQUEST_LOG_SIZE条，按耗时从高到低排序
+        entries = cache.get(SLOW_REQUESTS_KEY, [])
+        entries.append(entry)
+        entries.sort(key=lambda item: item['total'], reverse=True)
+        cache.set(SLOW_REQUESTS_KEY, entries[:settings.SLOW_REQUEST_LOG_SIZE], SLOW_REQUESTS_TIMEOUT)
+
+
+def get_slow_requests():
+    """最近的慢请求，按耗时从高到低排序"""
+    return cache.get(SLOW_REQUESTS_KEY, [])
@@ -13,7 +13,9 @@ class UserIDMiddleware:
         uid = self.generate_uid(request)
         request.uid = uid
         response = self.get_response(request)
-        response.set_cookie(USER_KEY, uid, max_age=TEN_YEARS, httponly=True)
+        # 只在用户还没有uid时下发cookie，其余响应不带Set-Cookie，可以被缓存
+        if USER_KEY not in request.COOKIES:
+            response.set_cookie(USER_KEY, uid, max_age=TEN_YEARS, httponly=True)
         return response
 
     def generate_uid(self, request):
@@ -0,0 +1,31 @@
+# Generated by Django 3.0.7 on 2026-10-18 19:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_auto_20200709_1003'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32, verbose_name='词元')),
+                ('weight', models.PositiveIntegerField(default=1, verbose_name='权重')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='blog.Article', verbose_name='文章')),
+            ],
+            options={
+                'verbose_name': '检索词元',
+                'verbose_name_plural': '检索词元',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['token', 'article'], name='blog_search_token_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.7 on 2026-10-18 19:13
+
+from django.db import migrations, models
+from django.template.defaultfilters import truncatechars_html
+
+
+def fill_excerpts(apps, schema_editor):
+    Article = apps.get_model('blog', 'Article')
+    BlogSettings = apps.get_model('config', 'BlogSettings')
+    blog_settings = BlogSettings.objects.filter(is_enable=True).first()
+    length = blog_settings.article_sub_length if blog_settings else 200
+    for article in Article.objects.only('id', 'content_html').iterator():
+        Article.objects.filter(id=article.id).update(excerpt=truncatechars_html(article.content_html, length))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_article_content_hash'),
+        ('config', '0004_auto_20200709_1003'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='excerpt',
+            field=models.TextField(blank=True, editable=False, help_text='按网站配置的文章摘要长度截取的content_html', verbose_name='正文摘录'),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
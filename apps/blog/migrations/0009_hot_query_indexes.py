@@ -0,0 +1,25 @@
+# Generated by Django 3.0.7 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_article_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['is_published', '-on_top', '-pub_time'], name='blog_article_list_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['is_published', '-pv'], name='blog_article_hottest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['is_published', 'pub_time'], name='blog_article_pub_time_idx'),
+        ),
+    ]
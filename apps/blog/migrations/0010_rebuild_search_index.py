@@ -0,0 +1,70 @@
+# Generated by Django 3.0.7 on 2026-10-18 21:02
+
+import re
+import html
+from collections import Counter
+
+from django.db import migrations
+from django.utils.html import strip_tags
+
+# 迁移不能依赖apps.blog.search的当前代码，这里保留编写时的分词规则，
+# 之后分词规则变化时应新增迁移或运行rebuild_search_index命令
+CJK_RE = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+')
+WORD_RE = re.compile(r'[^\W_]+')
+TOKEN_MAX_LENGTH = 32
+FIELD_WEIGHTS = (('title', 10), ('desc', 3), ('content_html', 1))
+BATCH_SIZE = 1000
+
+
+def tokenize(text):
+    """中日韩文字切分为unigram和bigram，其他文字按单词切分"""
+    tokens = []
+    for chunk in WORD_RE.findall((text or '').lower()):
+        start = 0
+        for match in CJK_RE.finditer(chunk):
+            if match.start() > start:
+                tokens.append(chunk[start:match.start()][:TOKEN_MAX_LENGTH])
+            run = match.group()
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            start = match.end()
+        if start < len(chunk):
+            tokens.append(chunk[start:][:TOKEN_MAX_LENGTH])
+    return tokens
+
+
+def token_weights(article):
+    counter = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        text = getattr(article, field) or ''
+        if field == 'content_html':
+            text = html.unescape(strip_tags(text))
+        for token in tokenize(text):
+            counter[token] += weight
+    return counter
+
+
+def rebuild_search_index(apps, schema_editor):
+    """索引中加入了汉字的unigram，重建所有文章的索引"""
+    Article = apps.get_model('blog', 'Article')
+    SearchToken = apps.get_model('blog', 'SearchToken')
+    SearchToken.objects.all().delete()
+    batch = []
+    for article in Article.objects.only('id', 'title', 'desc', 'content_html').iterator():
+        batch.extend(SearchToken(token=token, article_id=article.id, weight=weight)
+                     for token, weight in token_weights(article).items())
+        if len(batch) >= BATCH_SIZE:
+            SearchToken.objects.bulk_create(batch)
+            batch = []
+    SearchToken.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_search_index, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,21 @@
-import datetime
+import hashlib
+from collections import Counter
 
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.db import models
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, TruncMonth
 from django.conf import settings
+from django.utils import timezone
 from django.utils.functional import cached_property
 from django.template.defaultfilters import truncatechars_html
 
 import mistune
 from mdeditor.fields import MDTextField
 
+from utils.cache_version import get_cache_version, bump_cache_version
+
 
 class Category(models.Model):
     """文章分类"""
@@ -72,19 +78,32 @@ class Category(models.Model):
         :param obj: Category实例，可以不指定，默认为None
         :return: list
         """
-        tree = []
-        objects = cls.objects.filter(parent_category=obj, is_nav=True)
-        for obj in objects:
-            if obj.has_child:
-                subordinate = cls.get_category_tree(obj)
-            else:
-                subordinate = []
-            tree.append({
-                'current': obj,
-                'subordinate': subordinate,
-            })
+        if obj is not None:
+            return cls.build_category_tree(obj)
+
+        # 完整的导航树缓存起来，分类保存或删除时版本号变化，缓存自动失效（见signals.py）
+        version = get_cache_version('category')
+        tree = cache.get('category_tree', version=version)
+        if tree is None:
+            tree = cls.build_category_tree()
+            cache.set('category_tree', tree, None, version=version)
         return tree
 
+    @classmethod
+    def build_category_tree(cls, obj=None):
+        """只用一次查询取出所有导航分类，在内存中组装成get_category_tree所述的树形结构"""
+        children = {}
+        for category in cls.objects.filter(is_nav=True):
+            children.setdefault(category.parent_category_id, []).append(category)
+
+        def build(parent_id):
+            return [{
+                'current': category,
+                'subordinate': build(category.id),
+            } for category in children.get(parent_id, [])]
+
+        return build(obj.id if obj else None)
+
 
 class Tag(models.Model):
     """文章标签"""
@@ -106,6 +125,28 @@ class Tag(models.Model):
 
     article_count.short_description = "文章数量"
 
+    @classmethod
+    def with_article_count(cls):
+        """未删除的标签，用一次分组查询附带各自已发布文章的数目，覆盖逐个查询的article_count"""
+        return cls.objects.filter(is_deleted=False).annotate(
+            article_count=Count('article', filter=Q(article__is_published=True), distinct=True))
+
+
+class ArticleQuerySet(models.QuerySet):
+
+    def for_list(self):
+        """
+        文章列表使用的查询：分类和作者随主查询关联查出，标签一次预取，
+        评论数目用相关子查询在主查询中统计，不加载列表用不到的正文（列表展示预先生成的excerpt）
+        不JOIN评论表再GROUP BY，否则每一页都要先对所有文章分组、排序，用不上排序的索引
+        """
+        comment_model = self.model._meta.get_field('comment').related_model
+        comment_num = comment_model.objects.filter(article=OuterRef('pk'), is_deleted=False).order_by().values(
+            'article').annotate(count=Count('id')).values('count')
+        return self.select_related('category', 'author').prefetch_related('tag').annotate(
+            comment_num=Coalesce(Subquery(comment_num, output_field=models.IntegerField()), 0)
+        ).defer('content', 'content_html')
+
 
 class Article(models.Model):
     """文章"""
@@ -113,6 +154,9 @@ class Article(models.Model):
     desc = models.CharField(max_length=1024, blank=True, null=True, verbose_name="摘要")
     content = MDTextField(verbose_name="正文")
     content_html = models.TextField(verbose_name="正文html代码", blank=True, editable=False)
+    content_hash = models.CharField(max_length=40, verbose_name="正文哈希", blank=True, editable=False)
+    excerpt = models.TextField(verbose_name="正文摘录", blank=True, editable=False,
+                               help_text="按网站配置的文章摘要长度截取的content_html")
     category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, verbose_name="分类")
     tag = models.ManyToManyField(Tag, verbose_name="标签", blank=True)
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, verbose_name="作者")
@@ -128,31 +172,86 @@ class Article(models.Model):
     pv = models.PositiveIntegerField(default=0)
     uv = models.PositiveIntegerField(default=0)
 
+    objects = ArticleQuerySet.as_manager()
+
     class Meta:
         verbose_name = "文章"
         verbose_name_plural = verbose_name
         ordering = ['-on_top', '-pub_time']
+        indexes = [
+            # 已发布文章按默认排序取出（文章列表、归档、侧边栏最新文章）
+            models.Index(fields=['is_published', '-on_top', '-pub_time'], name='blog_article_list_idx'),
+            # hottest_articles
+            models.Index(fields=['is_published', '-pv'], name='blog_article_hottest_idx'),
+            # next_article、prev_article
+            models.Index(fields=['is_published', 'pub_time'], name='blog_article_pub_time_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
     def save(self, *args, **kwargs):
-        self.content_html = mistune.markdown(self.content)
+        # 正文没有变化时（如发布、置顶）不需要重新渲染Markdown
+        content_hash = self.get_content_hash(self.content)
+        rendered = []
+        if content_hash != self.content_hash or not self.content_html:
+            self.content_html = mistune.markdown(self.content)
+            self.content_hash = content_hash
+            self.excerpt = self.make_excerpt(self.content_html)
+            rendered = ['content_html', 'content_hash', 'excerpt']
+        elif not self.excerpt:
+            self.excerpt = self.make_excerpt(self.content_html)
+            rendered = ['excerpt']
+        # 只保存部分字段时也要保存重新生成的字段，否则旧数据每次保存都会重新渲染
+        if rendered and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set(rendered)
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def make_excerpt(content_html, length=None):
+        """截取列表页展示的正文摘录，length默认为网站配置的文章摘要长度"""
+        if length is None:
+            from utils.blog_setting import get_blog_setting  # 避免循环引用
+            length = get_blog_setting()['article_sub_length']
+        return truncatechars_html(content_html, length)
+
+    @classmethod
+    def rebuild_excerpts(cls, length=None, batch_size=500):
+        """
+        文章摘要长度修改后批量重新生成所有文章的摘录
+        :return: 更新的文章数目
+        """
+        if length is None:
+            from utils.blog_setting import get_blog_setting  # 避免循环引用
+            length = get_blog_setting()['article_sub_length']
+        ids = list(cls.objects.order_by('id').values_list('id', flat=True))
+        for i in range(0, len(ids), batch_size):
+            articles = [
+                cls(id=pk, excerpt=cls.make_excerpt(content_html, length))
+                for pk, content_html in cls.objects.filter(id__in=ids[i:i + batch_size]).values_list('id', 'content_html')
+            ]
+            cls.objects.bulk_update(articles, ['excerpt'], batch_size=batch_size)
+        # bulk_update不会触发post_save，手动使依赖文章的缓存失效
+        bump_cache_version('article')
+        return len(ids)
+
+    @staticmethod
+    def get_content_hash(content):
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
     def clean(self):
         # 未发布的文章不应该有发布时间
         if not self.is_published and self.pub_time is not None:
             self.pub_time = None
         if self.is_published and self.pub_time is None:
-            self.pub_time = datetime.datetime.now()
+            self.pub_time = timezone.now()
         # 置顶的文章必须是已发布的
         if self.on_top and not self.is_published:
             self.on_top = False
 
     def published(self):
         self.is_published = True
-        self.pub_time = datetime.datetime.now()
+        self.pub_time = timezone.now()
         self.save(update_fields=['is_published', 'pub_time'])
 
     def next_article(self):
@@ -166,11 +265,14 @@ class Article(models.Model):
             pub_time__lt=self.pub_time, is_published=True).order_by('pub_time').last()
 
     @classmethod
-    def latest_articles(cls, nums=None):
+    def latest_articles(cls, nums=None, for_list=False):
+        queryset = cls.objects.filter(is_published=True)
+        if for_list:
+            queryset = queryset.for_list()
         if nums:
-            return cls.objects.filter(is_published=True)[:nums]
+            return queryset[:nums]
         else:
-            return cls.objects.filter(is_published=True)
+            return queryset
 
     @classmethod
     def hottest_articles(cls, nums=None):
@@ -179,6 +281,28 @@ class Article(models.Model):
         else:
             return cls.objects.filter(is_published=True).order_by('-pv')
 
+    @classmethod
+    def archive_months(cls):
+        """
+        各月份已发布文章的数目，按月份倒序，用一次分组查询统计并缓存，文章变化后失效
+        返回结构示例：[(2020, 7, 3), (2020, 6, 5), (2019, 12, 1)]
+        """
+        version = get_cache_version('article')
+        months = cache.get('archive_months', version=version)
+        if months is None:
+            queryset = cls.objects.filter(is_published=True, pub_time__isnull=False)
+            rows = list(queryset.annotate(month=TruncMonth('pub_time')).values('month').annotate(
+                count=Count('id')).order_by('-month'))
+            if any(item['month'] is None for item in rows):
+                # MySQL没有加载时区表时TruncMonth（CONVERT_TZ）返回NULL，改为取出发布时间按本地时间统计
+                counter = Counter((pub_time.year, pub_time.month) for pub_time in map(
+                    timezone.localtime, queryset.values_list('pub_time', flat=True)))
+                months = [(year, month, count) for (year, month), count in sorted(counter.items(), reverse=True)]
+            else:
+                months = [(item['month'].year, item['month'].month, item['count']) for item in rows]
+            cache.set('archive_months', months, version=version)
+        return months
+
     @cached_property
     def comment_num(self):
         return self.comment_set.filter(is_deleted=False).count()
@@ -194,3 +318,20 @@ class Article(models.Model):
         return self.users_like.all().count()
 
     users_like_count.short_description = "点赞数量"
+
+
+class SearchToken(models.Model):
+    """文章全文检索的倒排索引，由apps.blog.search维护"""
+    token = models.CharField(max_length=32, verbose_name="词元")
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, verbose_name="文章")
+    weight = models.PositiveIntegerField(default=1, verbose_name="权重")
+
+    class Meta:
+        verbose_name = "检索词元"
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['token', 'article'], name='blog_search_token_idx'),
+        ]
+
+    def __str__(self):
+        return self.token
@@ -0,0 +1,102 @@
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+CURSOR_SALT = 'apps.blog.paginator'
+
+
+class CachedCountPaginator(Paginator):
+    """总数由调用方提供（如从缓存读取），不再对每一页执行COUNT(*)"""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @cached_property
+    def count(self):
+        return self._count() if callable(self._count) else self._count
+
+
+class KeysetPage:
+    def __init__(self, object_list, number, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Page %s of %s>' % (self.number, self.paginator.num_pages)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator(CachedCountPaginator):
+    """
+    文章列表的游标分页，按(-on_top, -pub_time, id)排序，用上一页最后一篇文章的排序键定位下一页，
+    不使用OFFSET，翻到很深的页也只读取一页的数据。
+    游标是签名后的(方向, 排序键, 页码)，不能被篡改；没有发布时间的文章不参与分页。
+    """
+    ordering = ('-on_top', '-pub_time', 'id')
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        object_list = object_list.filter(pub_time__isnull=False).order_by(*self.ordering)
+        super().__init__(object_list, per_page, count, **kwargs)
+
+    def encode_cursor(self, direction, article, number):
+        return signing.dumps(
+            [direction, article.on_top, article.pub_time.isoformat(), article.id, number], salt=CURSOR_SALT)
+
+    def decode_cursor(self, cursor):
+        """无效的游标返回第一页"""
+        try:
+            direction, on_top, pub_time, pk, number = signing.loads(cursor, salt=CURSOR_SALT)
+            return direction, (on_top, parse_datetime(pub_time), pk), int(number)
+        except (signing.BadSignature, TypeError, ValueError):
+            return 'next', None, 1
+
+    def page(self, cursor=None):
+        direction, key, number = self.decode_cursor(cursor) if cursor else ('next', None, 1)
+        queryset = self.object_list
+        if key is not None:
+            on_top, pub_time, pk = key
+            if direction == 'next':
+                queryset = queryset.filter(
+                    Q(on_top__lt=on_top) | Q(on_top=on_top, pub_time__lt=pub_time) |
+                    Q(on_top=on_top, pub_time=pub_time, id__gt=pk))
+            else:
+                queryset = queryset.filter(
+                    Q(on_top__gt=on_top) | Q(on_top=on_top, pub_time__gt=pub_time) |
+                    Q(on_top=on_top, pub_time=pub_time, id__lt=pk)).reverse()
+
+        # 多取一条用来判断是否还有下一页（往前翻时为上一页）
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if direction == 'next':
+            has_next, has_previous = has_more, key is not None
+        else:
+            object_list.reverse()
+            has_next, has_previous = True, has_more
+
+        next_cursor = previous_cursor = None
+        if object_list and has_next:
+            next_cursor = self.encode_cursor('next', object_list[-1], number + 1)
+        if object_list and has_previous:
+            previous_cursor = self.encode_cursor('prev', object_list[0], max(number - 1, 1))
+        return KeysetPage(object_list, number, self, next_cursor, previous_cursor)
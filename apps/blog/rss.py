@@ -1,9 +1,20 @@
+import hashlib
+
 from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from django.utils.feedgenerator import Rss201rev2Feed
+from django.utils.http import parse_http_date_safe
 
+from utils.cache_version import get_cache_versions
+from .models import Article, Category, Tag
 
-from .models import Article
+# feed内容依赖的数据，对应的模型保存或删除后缓存的feed失效
+FEED_DEPENDENCIES = ('article', 'category', 'tag')
 
 
 class ExtendedRSSFeed(Rss201rev2Feed):
@@ -12,14 +23,43 @@ class ExtendedRSSFeed(Rss201rev2Feed):
         handler.addQuickElement('content:html', item['content_html'])
 
 
-class LatestPostFeed(Feed):
+class CachedFeed(Feed):
+    """
+    生成的XML按请求路径缓存，文章、分类或标签变化后失效，
+    响应带ETag和Last-Modified，订阅器带If-None-Match或If-Modified-Since轮询且内容没有变化时返回304
+    """
     feed_type = ExtendedRSSFeed
+
+    def __call__(self, request, *args, **kwargs):
+        key = 'feed:%s:%s' % (hashlib.md5(request.path.encode('utf-8')).hexdigest(),
+                              get_cache_versions(*FEED_DEPENDENCIES))
+        entry = cache.get(key)
+        if entry is None:
+            response = super().__call__(request, *args, **kwargs)
+            entry = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': '"%s"' % hashlib.md5(response.content).hexdigest(),
+                'last_modified': response['Last-Modified'],
+            }
+            cache.set(key, entry)
+
+        response = get_conditional_response(
+            request, etag=entry['etag'], last_modified=parse_http_date_safe(entry['last_modified']))
+        if response is None:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = entry['last_modified']
+        return response
+
+
+class LatestPostFeed(CachedFeed):
     title = "My Blog System"
     link = "/rss/"
     description = "this is a blog system power by django"
 
     def items(self):
-        return Article.objects.filter(is_published=True)[:5]
+        return Article.latest_articles(5).defer('content')
 
     def item_title(self, item):
         return item.title
@@ -30,8 +70,49 @@ class LatestPostFeed(Feed):
     def item_link(self, item):
         return reverse('article-detail', args=[item.pk])
 
+    def item_pubdate(self, item):
+        return item.pub_time
+
+    def item_updateddate(self, item):
+        return item.mod_time
+
     def item_extra_kwargs(self, item):
         return {'content_html': self.item_content_html(item)}
 
     def item_content_html(self, item):
         return item.content_html
+
+
+class CategoryFeed(LatestPostFeed):
+    """某个分类（包括子分类）的最新文章"""
+
+    def get_object(self, request, category_id):
+        return get_object_or_404(Category, id=category_id, is_deleted=False)
+
+    def title(self, obj):
+        return '%s - 分类：%s' % (LatestPostFeed.title, obj.name)
+
+    def link(self, obj):
+        return reverse('category-rss', args=[obj.id])
+
+    def items(self, obj):
+        # 与文章列表的分类筛选一致，包含直接子分类的文章
+        return Article.latest_articles().filter(
+            Q(category_id=obj.id) | Q(category__parent_category_id=obj.id)
+        ).defer('content')[:5]
+
+
+class TagFeed(LatestPostFeed):
+    """某个标签的最新文章"""
+
+    def get_object(self, request, tag_id):
+        return get_object_or_404(Tag, id=tag_id, is_deleted=False)
+
+    def title(self, obj):
+        return '%s - 标签：%s' % (LatestPostFeed.title, obj.name)
+
+    def link(self, obj):
+        return reverse('tag-rss', args=[obj.id])
+
+    def items(self, obj):
+        return Article.latest_articles().filter(tag=obj).defer('content')[:5]
@@ -0,0 +1,117 @@
+import re
+import html
+from collections import Counter
+
+from django.db.models import Sum, OuterRef, Subquery
+from django.utils.html import strip_tags, escape
+from django.utils.safestring import mark_safe
+
+from .models import Article, SearchToken
+
+# 中日韩文字按单字（unigram）和相邻两个字（bigram）切分，其他文字按单词切分
+CJK_RE = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+')
+WORD_RE = re.compile(r'[^\W_]+')
+TOKEN_MAX_LENGTH = 32
+# 标题、摘要、正文中出现的词元权重不同
+FIELD_WEIGHTS = (('title', 10), ('desc', 3), ('content_html', 1))
+BATCH_SIZE = 1000
+
+
+def tokenize(text, query=False):
+    """
+    将文本切分为词元
+    :param text: 文本
+    :param query: 是否为查询，建立索引时每个汉字都保存unigram和bigram，
+                  查询时连续的多个汉字只用更有区分度的bigram，单独的一个汉字用unigram
+    :return: list
+    """
+    tokens = []
+    for chunk in WORD_RE.findall((text or '').lower()):
+        start = 0
+        for match in CJK_RE.finditer(chunk):
+            if match.start() > start:
+                tokens.append(chunk[start:match.start()][:TOKEN_MAX_LENGTH])
+            run = match.group()
+            if not query or len(run) == 1:
+                tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            start = match.end()
+        if start < len(chunk):
+            tokens.append(chunk[start:][:TOKEN_MAX_LENGTH])
+    return tokens
+
+
+def article_text(article, field):
+    value = getattr(article, field) or ''
+    return html.unescape(strip_tags(value)) if field == 'content_html' else value
+
+
+def token_weights(article):
+    """文章中每个词元的权重之和"""
+    counter = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(article_text(article, field)):
+            counter[token] += weight
+    return counter
+
+
+def build_tokens(article):
+    return [SearchToken(token=token, article_id=article.id, weight=weight)
+            for token, weight in token_weights(article).items()]
+
+
+def update_article_index(article):
+    """重建单篇文章的索引"""
+    SearchToken.objects.filter(article_id=article.id).delete()
+    SearchToken.objects.bulk_create(build_tokens(article))
+
+
+def rebuild_index():
+    """
+    清空并重建所有文章的索引
+    :return: 建立索引的文章数目
+    """
+    SearchToken.objects.all().delete()
+    count = 0
+    batch = []
+    for article in Article.objects.only('id', 'title', 'desc', 'content_html').iterator():
+        batch.extend(build_tokens(article))
+        count += 1
+        if len(batch) >= BATCH_SIZE:
+            SearchToken.objects.bulk_create(batch)
+            batch = []
+    SearchToken.objects.bulk_create(batch)
+    return count
+
+
+def search(queryset, keyword):
+    """
+    在queryset中查找包含keyword所有词元的文章，按相关度search_rank从高到低排序
+    """
+    terms = list(dict.fromkeys(tokenize(keyword, query=True)))
+    if not terms:
+        return queryset.none()
+
+    for term in terms:
+        queryset = queryset.filter(id__in=SearchToken.objects.filter(token=term).values('article_id'))
+
+    rank = SearchToken.objects.filter(token__in=terms, article=OuterRef('pk')).values(
+        'article').annotate(rank=Sum('weight')).values('rank')
+    return queryset.annotate(search_rank=Subquery(rank)).order_by('-search_rank', '-pub_time')
+
+
+def make_snippet(article, keyword, width=120):
+    """从正文中截取关键词附近的一段文字，关键词用<mark>标出"""
+    text = ' '.join(article_text(article, 'content_html').split())
+    words = [w for w in keyword.split() if w]
+    if not words:
+        return ''
+    pattern = re.compile('|'.join(re.escape(w) for w in words), re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(match.start() - width // 4, 0) if match else 0
+    snippet = text[start:start + width]
+    highlighted = pattern.sub(lambda m: '\0%s\1' % m.group(), snippet)
+    highlighted = escape(highlighted).replace('\0', '<mark>').replace('\1', '</mark>')
+    prefix = '...' if start > 0 else ''
+    suffix = '...' if start + width < len(text) else ''
+    return mark_safe(prefix + highlighted + suffix)
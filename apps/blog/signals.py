@@ -0,0 +1,31 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from utils.cache_version import bump_cache_version
+from .models import Category, Tag, Article
+from .search import update_article_index
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, **kwargs):
+    # 分类变化后重新生成导航树
+    bump_cache_version('category')
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_cache_version('tag')
+
+
+@receiver([post_save, post_delete], sender=Article)
+@receiver(m2m_changed, sender=Article.tag.through)
+def article_changed(sender, **kwargs):
+    # 依赖文章数据的缓存（如侧边栏）随之失效
+    bump_cache_version('article')
+
+
+@receiver(post_save, sender=Article)
+def article_saved(sender, instance, update_fields=None, **kwargs):
+    # 标题、摘要、正文没有变化时（如只修改了发布状态）不需要更新检索索引
+    if update_fields is None or {'title', 'desc', 'content'} & set(update_fields):
+        update_article_index(instance)
@@ -1,8 +1,20 @@
+import os
+import tempfile
+
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.template.loader import render_to_string
 from django.urls import reverse
 
+from utils.cache_version import get_cache_version
 from .models import Article
 
+# 记录已生成的sitemap对应的文章缓存版本号的文件
+VERSION_FILE = 'version'
+BUILD_LOCK_KEY = 'sitemap_build_lock'
+
 
 class ArticleSitemap(Sitemap):
     changefreq = "always"
@@ -10,10 +22,99 @@ class ArticleSitemap(Sitemap):
     protocol = 'https'
 
     def items(self):
-        return Article.objects.filter(is_published=True)
+        # 只取生成url需要的字段，按id排序使分页稳定
+        return Article.objects.filter(is_published=True).only('id', 'pub_time', 'mod_time').order_by('id')
 
     def lastmod(self, obj):
-        return obj.created_time
+        return obj.mod_time
 
     def location(self, obj):
         return reverse('article-detail', args=[obj.pk])
+
+    def get_urls(self, page=1, site=None, protocol=None):
+        urls = super().get_urls(page, site, protocol)
+        self.attach_keywords([url['item'] for url in urls])
+        return urls
+
+    @staticmethod
+    def attach_keywords(articles):
+        """用一次查询取出这一页文章的标签名，作为news:keywords"""
+        if not articles:
+            return
+        Through = Article.tag.through
+        ids = [article.id for article in articles]
+        names = {}
+        for article_id, name in Through.objects.filter(
+                article_id__gte=min(ids), article_id__lte=max(ids)).values_list('article_id', 'tag__name'):
+            names.setdefault(article_id, []).append(name)
+        for article in articles:
+            article.keywords = ','.join(names.get(article.id, []))
+
+
+def write_file(root, name, content):
+    # 先写入临时文件再替换，正在读取旧文件的请求不会读到写了一半的内容
+    fd, path = tempfile.mkstemp(dir=root, prefix='.%s.' % name)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.chmod(path, 0o644)
+    os.replace(path, os.path.join(root, name))
+
+
+def build_sitemap(root=None):
+    """
+    生成sitemap文件：文章数不超过单个文件的上限（50000）时sitemap.xml就是全部url，
+    否则分成sitemap-1.xml、sitemap-2.xml……，sitemap.xml是引用它们的sitemap index
+    :return: 生成的分片数
+    """
+    root = root or settings.SITEMAP_ROOT
+    os.makedirs(root, exist_ok=True)
+    # 先取版本号再生成，生成过程中文章又有变化时下一次访问会重新生成
+    version = get_cache_version('article')
+    sitemap = ArticleSitemap()
+    site = get_current_site(None)
+    pages = sitemap.paginator.num_pages
+
+    if pages <= 1:
+        write_file(root, 'sitemap.xml', render_to_string('sitemap.xml', {'urlset': sitemap.get_urls(1, site)}))
+    else:
+        shards = []
+        for page in range(1, pages + 1):
+            name = 'sitemap-%d.xml' % page
+            write_file(root, name, render_to_string('sitemap.xml', {'urlset': sitemap.get_urls(page, site)}))
+            shards.append('%s://%s%s' % (sitemap.protocol, site.domain, reverse('sitemap-shard', args=[page])))
+        write_file(root, 'sitemap.xml', render_to_string('sitemap_index.xml', {'sitemaps': shards}))
+
+    # 删除文章减少后多余的分片
+    for name in os.listdir(root):
+        if name.startswith('sitemap-') and name.endswith('.xml'):
+            page = name[len('sitemap-'):-len('.xml')]
+            if not page.isdigit() or pages <= 1 or int(page) > pages:
+                os.remove(os.path.join(root, name))
+
+    write_file(root, VERSION_FILE, str(version))
+    return pages
+
+
+def ensure_sitemap(root=None):
+    """
+    文章发布或修改后（文章缓存版本号变化）重新生成sitemap，
+    同一时间只有一个进程重新生成，其他进程继续返回旧的文件
+    """
+    root = root or settings.SITEMAP_ROOT
+    try:
+        with open(os.path.join(root, VERSION_FILE)) as f:
+            built_version = f.read().strip()
+    except FileNotFoundError:
+        built_version = None
+
+    if built_version == str(get_cache_version('article')):
+        return
+    locked = cache.add(BUILD_LOCK_KEY, 1, 5 * 60)
+    # 还没有生成过时没有旧文件可以返回，只能等待生成
+    if not locked and built_version is not None:
+        return
+    try:
+        build_sitemap(root)
+    finally:
+        if locked:
+            cache.delete(BUILD_LOCK_KEY)
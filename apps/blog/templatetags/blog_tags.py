@@ -1,5 +1,7 @@
 from django import template
 
+from utils.images import thumbnail_url
+
 register = template.Library()
 
 
@@ -14,3 +16,9 @@ def query_transform(request, **kwargs):
             url_params[k] = v
 
     return url_params.urlencode()
+
+
+# 图片缩略图的url，如{{ user.image|thumbnail:48 }}，缩略图还没有生成时返回原图
+@register.filter
+def thumbnail(field_file, size):
+    return thumbnail_url(field_file, int(size))
@@ -1,3 +1,666 @@
-from django.test import TestCase
+import io
+import os
+import time
+import shutil
+import datetime
+import tempfile
+import threading
 
-# Create your tests here.
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, transaction
+from django.db.models import DateTimeField, Value
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.comment.models import Comment
+from apps.users.models import UserProfile
+from utils.cache_version import bump_cache_version
+from utils.hyperloglog import HyperLogLog
+from utils.media import serve_media
+from utils.mmap_cache import HEADER_SIZE, SLOT, MmapCache
+from utils.query_plan import analyze_tables, find_executed_plan_problems, find_plan_problems, is_supported
+from .models import Article, Category, SearchToken
+from .paginator import KeysetPaginator
+from .search import make_snippet, search, tokenize
+from . import counters
+from .counters import record_visit, flush_article_counters, flush_pending_counters
+from .middleware.server_timing import RequestTimings, ServerTimingMiddleware, get_slow_requests
+
+
+class HyperLogLogTestCase(SimpleTestCase):
+
+    def test_memory_is_fixed(self):
+        hll = HyperLogLog()
+        size = len(hll.to_bytes())
+        for i in range(20000):
+            hll.add('uid-%d' % i)
+        self.assertEqual(size, 1024)
+        self.assertEqual(len(hll.to_bytes()), size)
+
+    def test_error_bound(self):
+        # 估计值应在3倍标准误差以内
+        for n in (10, 100, 1000, 10000, 50000):
+            hll = HyperLogLog()
+            for i in range(n):
+                hll.add('uid-%d' % i)
+            self.assertLessEqual(abs(hll.count() - n) / n, 3 * hll.error_rate, n)
+
+    def test_duplicates_do_not_change_estimate(self):
+        hll = HyperLogLog()
+        for i in range(500):
+            hll.add('uid-%d' % i)
+        estimate = len(hll)
+        for i in range(500):
+            self.assertFalse(hll.add('uid-%d' % i))
+        self.assertEqual(len(hll), estimate)
+
+    def test_merge(self):
+        a, b, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            (a if i % 2 else b).add(i)
+            union.add(i)
+        a.merge(HyperLogLog.from_bytes(b.to_bytes()))
+        self.assertEqual(a.to_bytes(), union.to_bytes())
+
+
+class MmapCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def make_cache(self, slot_sizes=(256, 1024, 4096), max_size=1024 * 1024, pinned=()):
+        return MmapCache(os.path.join(self.directory, 'cache'), {
+            'OPTIONS': {'MAX_SIZE': max_size, 'SLOT_SIZES': slot_sizes, 'PINNED_KEY_PREFIXES': pinned},
+        })
+
+    def make_tiny_cache(self, pinned=()):
+        # 只有一个区域，8个槽，每个键都会探测全部的槽
+        return self.make_cache((256,), HEADER_SIZE + 8 * (SLOT.size + 256), pinned)
+
+    def test_get_set_delete(self):
+        cache = self.make_cache()
+        self.assertIsNone(cache.get('key'))
+        self.assertTrue(cache.set('key', {'value': 1}))
+        self.assertEqual(cache.get('key'), {'value': 1})
+        self.assertFalse(cache.add('key', 2))
+        self.assertTrue(cache.set('key', 'x' * 3000))
+        self.assertEqual(cache.get('key'), 'x' * 3000)
+        self.assertEqual(cache.get_many(['key', 'missing']), {'key': 'x' * 3000})
+        self.assertTrue(cache.delete('key'))
+        self.assertIsNone(cache.get('key'))
+        self.assertTrue(cache.add('key', 2))
+        self.assertEqual(cache.pop('key'), 2)
+        self.assertIsNone(cache.pop('key'))
+        self.assertTrue(cache.add('key', 2))
+        cache.clear()
+        self.assertIsNone(cache.get('key'))
+
+    def test_expiry(self):
+        cache = self.make_cache()
+        cache.set('short', 1, 0.2)
+        cache.set('forever', 1, None)
+        self.assertEqual(cache.get('short'), 1)
+        time.sleep(0.3)
+        self.assertIsNone(cache.get('short'))
+        self.assertEqual(cache.get('forever'), 1)
+
+    def test_lru_eviction(self):
+        cache = self.make_tiny_cache()
+        for i in range(8):
+            cache.set('key%d' % i, i)
+        cache.get('key0')
+        cache.set('key8', 8)
+        self.assertEqual(cache.get('key0'), 0)
+        self.assertIsNone(cache.get('key1'))
+        self.assertEqual(cache.get('key8'), 8)
+
+    def test_oversize_value_is_rejected(self):
+        cache = self.make_tiny_cache()
+        cache.set('key', 'small')
+        self.assertFalse(cache.set('key', 'x' * 1000))
+        self.assertIsNone(cache.get('key'))
+
+    def test_small_values_spill_into_larger_slots(self):
+        # 8个256字节的槽和1个2048字节的槽
+        cache = self.make_cache((256, 2048), HEADER_SIZE + 2 * 8 * (SLOT.size + 256))
+        for i in range(9):
+            self.assertTrue(cache.set('key%d' % i, i))
+        self.assertEqual(cache.get_many(['key%d' % i for i in range(9)]), {'key%d' % i: i for i in range(9)})
+
+    def test_pinned_keys_are_not_evicted(self):
+        cache = self.make_tiny_cache(pinned=('version:',))
+        for i in range(4):
+            cache.set('version:%d' % i, i)
+        for i in range(20):
+            cache.set('key%d' % i, i)
+        self.assertEqual(cache.get_many(['version:%d' % i for i in range(4)]), {'version:%d' % i: i for i in range(4)})
+        self.assertEqual(cache.incr('version:0', 5), 5)
+        self.assertEqual(cache.get('version:0'), 5)
+
+    def test_pinned_keys_cannot_fill_the_cache(self):
+        # 8个槽中固定的键最多占一半
+        cache = self.make_tiny_cache(pinned=('version:',))
+        for i in range(4):
+            self.assertTrue(cache.set('version:%d' % i, i))
+        self.assertFalse(cache.add('version:4', 4))
+        self.assertTrue(cache.set('version:0', 0))
+        for i in range(20):
+            self.assertTrue(cache.set('key%d' % i, i))
+        cache.delete('version:1')
+        self.assertTrue(cache.add('version:4', 4))
+
+    def test_instances_share_mapping(self):
+        # Django为每个线程创建一个实例，它们不能各自打开文件
+        caches = []
+
+        def use_cache():
+            cache = self.make_cache()
+            cache.set('key', 'value')
+            caches.append(cache)
+
+        threads = [threading.Thread(target=use_cache) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(caches), 20)
+        self.assertEqual({cache._fd for cache in caches}, {caches[0]._fd})
+        self.assertTrue(all(cache._mm is caches[0]._mm for cache in caches))
+
+    def test_corrupt_slot_is_a_miss(self):
+        cache = self.make_cache()
+        cache.set('key', 'value')
+        digest = cache._digest('key', None)
+        slot = cache._locked(cache._find, digest, time.time())
+        cache._mm[slot + SLOT.size:slot + SLOT.size + 8] = b'\xff' * 8
+        self.assertIsNone(cache.get('key'))
+        self.assertFalse(cache.has_key('key'))
+        self.assertTrue(cache.add('key', 'value'))
+        self.assertEqual(cache.get('key'), 'value')
+
+    def test_incr_is_atomic_across_processes(self):
+        cache = self.make_cache()
+        cache.set('counter', 0)
+        pids = []
+        for i in range(4):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    for j in range(250):
+                        cache.incr('counter')
+                    status = 0
+                finally:
+                    os._exit(status)
+            pids.append(pid)
+        for pid in pids:
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertEqual(cache.get('counter'), 1000)
+
+
+class RecordVisitTestCase(TransactionTestCase):
+    """写回计数需要在事务外执行，需要TransactionTestCase"""
+
+    def setUp(self):
+        cache.clear()
+        # 只在测试中显式写回
+        patcher = mock.patch.object(counters, '_last_flush', float('inf'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(counters._pending.clear)
+        user = UserProfile.objects.create_user('user', 'user@example.com', 'password')
+        category = Category.objects.create(name='分类', sort=1, owner=user)
+        self.article = Article.objects.create(title='标题', content='正文', category=category,
+                                              author=user, is_published=True)
+        self.path = '/article/%d/' % self.article.id
+        self.counter_keys = ['article_counter:pv:%d' % self.article.id, 'article_counter:uv:%d' % self.article.id]
+
+    def test_unique_visitors(self):
+        for uid in ('a', 'b', 'c', 'a', 'b'):
+            record_visit(uid, self.path, self.article.id)
+        self.assertEqual(flush_pending_counters(), 1)
+        self.assertEqual(flush_pending_counters(), 0)
+        record_visit('d', self.path, self.article.id)
+        flush_pending_counters()
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.pv, 4)
+        self.assertEqual(self.article.uv, 4)
+
+    def test_flush_removes_counters(self):
+        # 写回后计数从缓存中删除，访问过的文章不会一直占着固定的槽
+        articles = [self.article] + [
+            Article.objects.create(title='标题%d' % i, content='正文', category=self.article.category,
+                                   author=self.article.author, is_published=True)
+            for i in range(5)]
+        for article in articles:
+            record_visit('a', '/article/%d/' % article.id, article.id)
+        self.assertEqual(flush_pending_counters(), 6)
+        keys = ['article_counter:%s:%d' % (field, article.id) for article in articles for field in ('pv', 'uv')]
+        self.assertEqual(cache.get_many(keys), {})
+
+    def test_flush_only_pending_articles(self):
+        record_visit('a', self.path, self.article.id)
+        # 其他进程累积、没有正常退出时留下的增量，由flush_article_counters命令扫描所有文章写回
+        counters._pending.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(flush_pending_counters(), 0)
+        out = io.StringIO()
+        call_command('flush_article_counters', stdout=out)
+        self.assertIn('1', out.getvalue())
+        self.assertEqual(cache.get_many(self.counter_keys), {})
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.pv, 1)
+
+    def test_flush_after_interval(self):
+        counters._last_flush = 0
+        record_visit('a', self.path, self.article.id)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.pv, 1)
+        record_visit('b', self.path, self.article.id)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.uv, 1)
+        self.assertEqual(cache.get(self.counter_keys[1]), 1)
+
+    def test_failed_flush_keeps_counters(self):
+        record_visit('a', self.path, self.article.id)
+        with mock.patch('apps.blog.counters._update_article', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                flush_pending_counters()
+        self.assertEqual(cache.get(self.counter_keys[0]), 1)
+        self.assertEqual(flush_pending_counters(), 1)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.pv, 1)
+
+    def test_flush_is_deferred_in_transaction(self):
+        record_visit('a', self.path, self.article.id)
+        with transaction.atomic():
+            self.assertEqual(flush_pending_counters(), 0)
+            with self.assertRaises(transaction.TransactionManagementError):
+                flush_article_counters()
+        self.assertEqual(flush_pending_counters(), 1)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_evicting_cache_writes_through(self):
+        record_visit('a', self.path, self.article.id)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.pv, 1)
+        self.assertEqual(self.article.uv, 1)
+        self.assertEqual(flush_article_counters(), 0)
+
+
+@override_settings(SERVER_TIMING=True, SLOW_REQUEST_THRESHOLD=10 ** 6)
+class ServerTimingTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_header(self):
+        response = self.client.get(reverse('article-list'))
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^total;dur=\d+\.\d, view;dur=\d+\.\d, render;dur=\d+\.\d, '
+            r'sql;dur=\d+\.\d;desc="[1-9]\d* queries", cache;desc="\d+ hits [1-9]\d* misses"$')
+        self.assertEqual(get_slow_requests(), [])
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0)
+    def test_slow_request_is_logged(self):
+        self.client.get(reverse('article-list') + '?page=1')
+        entries = get_slow_requests()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['path'], '/?page=1')
+        self.assertEqual(entries[0]['status'], 200)
+        self.assertGreater(entries[0]['sql_count'], 0)
+
+    @override_settings(SLOW_REQUEST_LOG_SIZE=3)
+    def test_keeps_slowest_requests(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        for total in (5, 1, 9, 3, 7):
+            timings = RequestTimings()
+            timings.total = total
+            ServerTimingMiddleware.log_slow_request(request, HttpResponse(), timings)
+        self.assertEqual([entry['total'] for entry in get_slow_requests()], [9, 7, 5])
+
+    def test_admin_link(self):
+        UserProfile.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        self.assertContains(self.client.get(reverse('admin:index')), 'href="%s"' % reverse('slow-requests'))
+        self.assertContains(self.client.get(reverse('slow-requests')), '慢请求')
+
+
+class SearchTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = UserProfile.objects.create_user('user', 'user@example.com', 'password')
+        category = Category.objects.create(name='分类', sort=1, owner=user)
+
+        def create(title, content):
+            return Article.objects.create(title=title, content=content, category=category, author=user,
+                                          is_published=True)
+        cls.cache_article = create('Django缓存的实现', '使用Memcached缓存页面')
+        cls.middleware_article = create('中间件', '实现一个Django中间件，顺便提到缓存')
+        cls.mixed_article = create('Mixed', 'a中b <script>alert(1)</script>')
+
+    def search(self, keyword):
+        return list(search(Article.objects.all(), keyword))
+
+    def test_tokenize_latin(self):
+        self.assertEqual(tokenize('Django ORM, QuerySet_API!'), ['django', 'orm', 'queryset', 'api'])
+
+    def test_tokenize_cjk(self):
+        self.assertEqual(tokenize('实现Django缓存'), ['实', '现', '实现', 'django', '缓', '存', '缓存'])
+        self.assertEqual(tokenize('实现Django缓存', query=True), ['实现', 'django', '缓存'])
+        self.assertEqual(tokenize('a中b'), ['a', '中', 'b'])
+
+    def test_single_character(self):
+        # 只出现在bigram第二个字的位置，或夹在英文单词之间的单个汉字
+        self.assertCountEqual(self.search('现'), [self.cache_article, self.middleware_article])
+        self.assertEqual(self.search('中'), [self.middleware_article, self.mixed_article])
+
+    def test_all_terms_required(self):
+        self.assertEqual(self.search('django memcached'), [self.cache_article])
+        self.assertEqual(self.search('django 不存在'), [])
+        self.assertEqual(self.search('!!'), [])
+
+    def test_ranking(self):
+        # 标题命中的权重高于正文
+        self.assertEqual(self.search('缓存'), [self.cache_article, self.middleware_article])
+        self.assertEqual(self.search('中间件'), [self.middleware_article])
+
+    def test_snippet(self):
+        snippet = make_snippet(self.mixed_article, 'A中')
+        self.assertIn('<mark>a中</mark>', snippet)
+        self.assertIn('&lt;script&gt;', snippet)
+        self.assertEqual(make_snippet(self.mixed_article, ' '), '')
+
+    def test_rebuild_search_index(self):
+        SearchToken.objects.all().delete()
+        self.assertEqual(self.search('缓存'), [])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.search('缓存'), [self.cache_article, self.middleware_article])
+
+
+class PageCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = UserProfile.objects.create_user('user', 'user@example.com', 'password')
+        category = Category.objects.create(name='分类', sort=1, owner=user)
+        self.article = Article.objects.create(title='标题', content='正文', category=category,
+                                              author=user, is_published=True, pub_time=timezone.now())
+
+    def test_hit(self):
+        url = reverse('article-list')
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.content, response.content)
+        # 查询参数的顺序和空参数不影响缓存键
+        self.client.get(url + '?b=2&a=1')
+        with self.assertNumQueries(0):
+            self.client.get(url + '?a=1&b=2&c=')
+
+    def test_hit_records_visit(self):
+        url = reverse('article-detail', args=[self.article.id])
+        self.client.get(url)
+        with mock.patch('apps.blog.middleware.page_cache.record_visit') as record:
+            self.client.get(url)
+        record.assert_called_once_with(mock.ANY, url, self.article.id)
+
+    def test_authenticated_user_bypasses_cache(self):
+        url = reverse('article-list')
+        self.client.login(username='user', password='password')
+        self.client.get(url)
+        Article.objects.filter(id=self.article.id).update(title='新标题')
+        self.assertContains(self.client.get(url), '新标题')
+        # 登录用户的页面也不会缓存给匿名用户
+        self.client.logout()
+        Article.objects.filter(id=self.article.id).update(title='匿名用户看到的标题')
+        self.assertContains(self.client.get(url), '匿名用户看到的标题')
+
+    def test_version_bump_invalidates(self):
+        url = reverse('article-list')
+        self.client.get(url)
+        # update不触发信号，缓存的页面不变
+        Article.objects.filter(id=self.article.id).update(title='新标题')
+        self.assertNotContains(self.client.get(url), '新标题')
+        bump_cache_version('article')
+        self.assertContains(self.client.get(url), '新标题')
+
+
+class FeedTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = UserProfile.objects.create_user('user', 'user@example.com', 'password')
+        category = Category.objects.create(name='分类', sort=1, owner=user)
+        self.article = Article.objects.create(title='标题', content='正文', category=category,
+                                              author=user, is_published=True, pub_time=timezone.now())
+
+    def test_if_none_match(self):
+        response = self.client.get(reverse('rss'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '标题')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('rss'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertTrue(response['ETag'])
+
+    def test_if_modified_since(self):
+        response = self.client.get(reverse('rss'))
+        response = self.client.get(reverse('rss'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_feed_is_returned(self):
+        etag = self.client.get(reverse('rss'))['ETag']
+        self.article.title = '新标题'
+        self.article.save()
+        response = self.client.get(reverse('rss'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '新标题')
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ArticleDetailConditionalTestCase(TestCase):
+    """登录用户不经过整页缓存，由视图本身处理条件请求"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('user', 'user@example.com', 'password')
+        category = Category.objects.create(name='分类', sort=1, owner=self.user)
+        self.article = Article.objects.create(title='标题', content='正文', category=category,
+                                              author=self.user, is_published=True, pub_time=timezone.now())
+        self.url = reverse('article-detail', args=[self.article.id])
+        self.client.login(username='user', password='password')
+
+    def test_if_none_match(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        with mock.patch('apps.blog.views.record_visit') as record:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertIn('no-cache', response['Cache-Control'])
+        # 返回304时同样计入访问量
+        record.assert_called_once_with(mock.ANY, self.url, self.article.id)
+
+    def test_if_modified_since(self):
+        response = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_comment_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        Comment.objects.create(article=self.article, content='第一条评论内容', author=self.user)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_user(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.logout()
+        UserProfile.objects.create_user('other', 'other@example.com', 'password')
+        self.client.login(username='other', password='password')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ServeMediaTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.root = os.path.join(directory, 'uploads')
+        os.makedirs(self.root)
+        self.content = bytes(range(100))
+        with open(os.path.join(self.root, 'file.bin'), 'wb') as f:
+            f.write(self.content)
+        with open(os.path.join(directory, 'secret.txt'), 'w') as f:
+            f.write('secret')
+        self.factory = RequestFactory()
+
+    def serve(self, path='file.bin', **headers):
+        return serve_media(self.factory.get('/media/' + path, **headers), path, self.root)
+
+    def test_whole_file(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        response.close()
+
+    def test_range(self):
+        response = self.serve(HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-9/100')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[:10])
+        response = self.serve(HTTP_RANGE='bytes=-5')
+        self.assertEqual(response['Content-Range'], 'bytes 95-99/100')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+
+    def test_unsatisfiable_range(self):
+        response = self.serve(HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_stale_if_range_returns_whole_file(self):
+        response = self.serve(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='Sat, 01 Jan 2000 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        response.close()
+
+    def test_if_modified_since(self):
+        last_modified = self.serve()['Last-Modified']
+        self.assertEqual(self.serve(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_path_traversal(self):
+        for path in ('../secret.txt', 'missing.bin', ''):
+            with self.assertRaises(Http404):
+                self.serve(path)
+        with self.assertRaises(Http404):
+            serve_media(self.factory.get('/'), os.path.join(os.path.dirname(self.root), 'secret.txt'), self.root)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_x_accel_redirect(self):
+        response = self.serve()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/file.bin')
+        self.assertEqual(response.content, b'')
+
+
+class ArticleSaveTestCase(TestCase):
+
+    def test_partial_save_persists_rendered_fields(self):
+        user = UserProfile.objects.create_user('user', 'user@example.com', 'password')
+        category = Category.objects.create(name='分类', sort=1, owner=user)
+        article = Article.objects.create(title='标题', content='**正文**', category=category, author=user)
+        # 没有保存渲染结果的旧数据
+        Article.objects.filter(id=article.id).update(content_html='', content_hash='', excerpt='')
+        article = Article.objects.get(id=article.id)
+        article.published()
+        article = Article.objects.get(id=article.id)
+        self.assertTrue(article.is_published)
+        self.assertEqual(article.content_html, '<p><strong>正文</strong></p>\n')
+        self.assertEqual(article.content_hash, Article.get_content_hash('**正文**'))
+        self.assertTrue(article.excerpt)
+
+
+class ArchiveMonthsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = UserProfile.objects.create_user('user', 'user@example.com', 'password')
+        category = Category.objects.create(name='分类', sort=1, owner=user)
+        tz = timezone.get_current_timezone()
+        Article.objects.bulk_create([
+            Article(title='标题%d' % i, content='正文', category=category, author=user, is_published=True,
+                    pub_time=timezone.make_aware(pub_time, tz))
+            for i, pub_time in enumerate([datetime.datetime(2020, 7, 1), datetime.datetime(2020, 7, 31, 23),
+                                          datetime.datetime(2020, 6, 15), datetime.datetime(2019, 12, 31, 23)])
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_archive_months(self):
+        self.assertEqual(Article.archive_months(), [(2020, 7, 2), (2020, 6, 1), (2019, 12, 1)])
+
+    def test_null_months(self):
+        # MySQL没有加载时区表时TruncMonth返回NULL
+        with mock.patch('apps.blog.models.TruncMonth', return_value=Value(None, output_field=DateTimeField())):
+            self.assertEqual(Article.archive_months(), [(2020, 7, 2), (2020, 6, 1), (2019, 12, 1)])
+
+
+@skipUnless(is_supported(), '只能检查SQLite和MySQL的执行计划')
+class ArticleQueryPlanTestCase(TestCase):
+    """热点查询的执行计划中不应出现全表扫描和额外排序"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = UserProfile.objects.create_user('user', 'user@example.com', 'password')
+        category = Category.objects.create(name='分类', sort=1, owner=user)
+        now = timezone.now()
+        Article.objects.bulk_create([
+            Article(title='标题%d' % i, content='正文', content_html='<p>正文</p>', category=category,
+                    author=user, is_published=i % 5 != 0, on_top=i % 50 == 1, pv=i * 7 % 1000,
+                    pub_time=now - datetime.timedelta(hours=i) if i % 5 else None)
+            for i in range(2000)
+        ])
+        cls.article = Article.objects.filter(is_published=True)[100]
+        analyze_tables(Article)
+
+    def assertNoPlanProblems(self, queryset):
+        self.assertEqual(find_plan_problems(queryset), [], str(queryset.query))
+
+    def assertNoExecutedPlanProblems(self, func):
+        self.assertEqual(find_executed_plan_problems(func), [])
+
+    def test_latest_articles(self):
+        self.assertNoPlanProblems(Article.latest_articles(10))
+
+    def test_hottest_articles(self):
+        self.assertNoPlanProblems(Article.hottest_articles(10))
+
+    def test_next_article(self):
+        self.assertNoExecutedPlanProblems(self.article.next_article)
+
+    def test_prev_article(self):
+        self.assertNoExecutedPlanProblems(self.article.prev_article)
+
+    def test_article_list(self):
+        # 文章列表第一页和用游标翻到的下一页
+        def paginate():
+            paginator = KeysetPaginator(Article.latest_articles(for_list=True), 10, count=0)
+            paginator.page(paginator.page().next_cursor)
+        self.assertNoExecutedPlanProblems(paginate)
@@ -1,19 +1,35 @@
+import os
 import pprint
 import logging
-from datetime import date
+import hashlib
 
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
 from django.core.cache import cache
-from django.db.models import Q, F
+from django.db.models import Q, Max
+from django.http import FileResponse, Http404
 from django.views.generic import ListView, DetailView, TemplateView
 from django.shortcuts import render, get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import urlencode, http_date
 
 from apps.config.models import SideBar, BlogSettings
 from apps.comment.models import Comment
 from .models import Article, Category, Tag
 from .filters import ArticleFilter
+from .counters import record_visit
+from .search import make_snippet
+from .sitemap import ensure_sitemap
+from .paginator import KeysetPaginator, CachedCountPaginator
+from .middleware.page_cache import PAGE_DEPENDENCIES
+from .middleware.server_timing import get_slow_requests
 from apps.comment.forms import CommentForm
 
 from utils.blog_setting import get_blog_setting
+from utils.cache_version import get_cache_version, get_cache_versions
+from utils.request_memo import request_memo
 
 
 class CommonViewMixin:
@@ -21,28 +37,63 @@ class CommonViewMixin:
         context = super().get_context_data(**kwargs)
         context.update({
             'sidebars': self.get_sidebars(),
-            'filter_form': ArticleFilter(self.request.GET, queryset=Article.objects.filter(is_published=True)).form,
+            'filter_form': self.get_filter().form,
             'category_tree': Category.get_category_tree(),
             'blog_setting': get_blog_setting(),
         })
         return context
 
     def get_sidebars(self):
-        return SideBar.objects.filter(is_enable=True)
+        return SideBar.get_enabled()
+
+    def get_filter(self):
+        """同一个请求内只创建并校验一次文章过滤器"""
+        return request_memo(self.request, 'article_filter', lambda: ArticleFilter(
+            self.request.GET, queryset=Article.latest_articles()))
 
 
 class ArticleListView(CommonViewMixin, ListView):
-    paginate_by = get_blog_setting()['per_page_count']
     context_object_name = 'article_list'
     template_name = 'blog/list.html'
+    cursor_kwarg = 'cursor'
+
+    def get_paginate_by(self, queryset):
+        # 每次请求时读取，修改网站配置后无需重启即可生效
+        return get_blog_setting()['per_page_count']
 
     def get_queryset(self):
-        filter_queryset = ArticleFilter(self.request.GET, queryset=Article.latest_articles()).qs
-        return filter_queryset
+        queryset = self.get_filter().qs.for_list()
+        if self.request.GET.get('key'):
+            # 搜索结果需要从正文中截取关键词所在的片段
+            queryset = queryset.defer(None).defer('content')
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.request.GET.get('key') or self.page_kwarg in self.request.GET:
+            # 搜索结果按相关度排序，以及旧的按页码翻页的链接，仍使用页码分页
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size, count=self.get_article_count)
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return CachedCountPaginator(queryset, per_page, count=self.get_article_count, orphans=orphans,
+                                    allow_empty_first_page=allow_empty_first_page, **kwargs)
+
+    def get_article_count(self):
+        """文章总数按过滤条件缓存，文章变化后失效"""
+        params = sorted((k, v) for k in ArticleFilter.base_filters for v in self.request.GET.getlist(k) if v)
+        key = 'article_count:%s' % hashlib.md5(urlencode(params).encode('utf-8')).hexdigest()
+        version = get_cache_version('article')
+        count = cache.get(key, version=version)
+        if count is None:
+            count = self.get_filter().qs.count()
+            cache.set(key, count, version=version)
+        return count
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        filter_form = ArticleFilter(self.request.GET, queryset=Article.latest_articles()).form
+        filter_form = self.get_filter().form
         filter_items = {}
 
         if filter_form.is_valid():
@@ -50,6 +101,11 @@ class ArticleListView(CommonViewMixin, ListView):
                 if v:
                     filter_items[filter_form.fields[k].label] = v
 
+        key = filter_form.cleaned_data.get('key') if filter_form.is_valid() else None
+        if key:
+            for article in context['article_list']:
+                article.search_snippet = make_snippet(article, key)
+
         context.update({
             'filter_items': filter_items,
         })
@@ -64,44 +120,128 @@ class ArticleDetailView(CommonViewMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        # 评论在页面加载后通过comment-threads分页获取
         context.update({
-            'comment_tree': Comment.get_comment_tree(self.object),
             'comment_form': CommentForm(),
         })
         return context
 
     def get(self, request, *args, **kwargs):
-        response = super().get(request, *args, **kwargs)
+        self.object = self.get_object()
+        # 返回304时同样计入访问量
         self.handle_visited()
+        # 先用几个很小的查询算出校验值，页面没有变化时不需要查询侧边栏、评论树和渲染模板
+        etag, last_modified = self.get_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            context = self.get_context_data(object=self.object)
+            response = self.render_to_response(context)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # 浏览器每次都需要重新校验，登录状态不同页面内容不同
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
         return response
 
+    def get_validators(self):
+        """
+        根据文章的修改时间、最新评论的时间、网站内容的版本号（侧边栏等依赖的数据）和当前用户生成ETag，
+        Last-Modified取其中最晚的时间
+        :return: (ETag, Last-Modified的时间戳)
+        """
+        comment_time = Comment.objects.filter(article=self.object).aggregate(time=Max('mod_time'))['time']
+        versions = get_cache_versions(*PAGE_DEPENDENCIES)
+        user = self.request.user
+        value = '%s:%s:%s:%s:%s' % (self.object.id, self.object.mod_time.timestamp(),
+                                    comment_time.timestamp() if comment_time else '', versions,
+                                    user.pk if user.is_authenticated else '')
+        # 页面中的csrf token每次不同，使用弱ETag
+        etag = 'W/"%s"' % hashlib.md5(value.encode('utf-8')).hexdigest()
+        # 版本号是数据最后一次变化时的毫秒时间戳
+        times = [self.object.mod_time.timestamp(), max(int(version) for version in versions.split(':')) / 1000]
+        if comment_time:
+            times.append(comment_time.timestamp())
+        return etag, int(max(times))
+
     def handle_visited(self):
-        increase_pv = False
-        increase_uv = False
-        uid = self.request.uid
-        pv_key = 'pv:%s:%s' % (uid, self.request.path)
-        if not cache.get(pv_key):
-            increase_pv = True
-            cache.set(pv_key, 1, 1*60)  # 1分钟有效
-
-        uv_key = 'uv:%s:%s:%s' % (uid, str(date.today()), self.request.path)
-        if not cache.get(uv_key):
-            increase_uv = True
-            cache.set(uv_key, 1, 24*60*60)  # 24小时有效
-
-        if increase_pv and increase_uv:
-            Article.objects.filter(pk=self.object.id).update(pv=F('pv') + 1, uv=F('uv') + 1)
-        elif increase_pv:
-            Article.objects.filter(pk=self.object.id).update(pv=F('pv') + 1)
-        elif increase_uv:
-            Article.objects.filter(pk=self.object.id).update(uv=F('uv') + 1)
+        record_visit(self.request.uid, self.request.path, self.object.id)
 
 
 class ArticleArchivesView(CommonViewMixin, ListView):
-    queryset = Article.objects.filter(is_published=True).order_by('-pub_time')
+    """按年分页的文章归档，每页只列出一年的文章，并按月分组"""
     context_object_name = 'article_list'
     template_name = 'blog/archives.html'
 
+    def get_archive_years(self):
+        """
+        根据每月文章数目汇总出每年的文章数目
+        返回结构示例：[{'year': 2020, 'count': 8, 'months': {7: 3, 6: 5}}]
+        """
+        years = []
+        for year, month, count in Article.archive_months():
+            if not years or years[-1]['year'] != year:
+                years.append({'year': year, 'count': 0, 'months': {}})
+            years[-1]['count'] += count
+            years[-1]['months'][month] = count
+        return years
+
+    def get_current_year(self):
+        try:
+            year = int(self.request.GET['year'])
+        except (KeyError, ValueError):
+            year = None
+        years = [item['year'] for item in self.archive_years]
+        if year not in years:
+            year = years[0] if years else None
+        return year
+
+    def get(self, request, *args, **kwargs):
+        self.archive_years = self.get_archive_years()
+        self.current_year = self.get_current_year()
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        if self.current_year is None:
+            return Article.objects.none()
+        return Article.objects.filter(is_published=True, pub_time__year=self.current_year).select_related(
+            'category').prefetch_related('tag').defer('content', 'content_html').order_by('-pub_time')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        months = []
+        month_counts = {}
+        for item in self.archive_years:
+            if item['year'] == self.current_year:
+                month_counts = item['months']
+        # 一次遍历将文章按月分组
+        for article in context['article_list']:
+            month = timezone.localtime(article.pub_time).month
+            if not months or months[-1]['month'] != month:
+                months.append({'month': month, 'count': month_counts.get(month, 0), 'articles': []})
+            months[-1]['articles'].append(article)
+
+        context.update({
+            'archive_years': self.archive_years,
+            'current_year': self.current_year,
+            'archive_months': months,
+        })
+        return context
+
+
+def sitemap_view(request, page=None):
+    """返回预先生成的sitemap文件，文章发布或修改后在下一次访问时重新生成"""
+    ensure_sitemap()
+    path = os.path.join(settings.SITEMAP_ROOT, 'sitemap.xml' if page is None else 'sitemap-%d.xml' % page)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        raise Http404
+    response = get_conditional_response(request, last_modified=int(mtime))
+    if response is None:
+        response = FileResponse(open(path, 'rb'), content_type='application/xml')
+        response['Last-Modified'] = http_date(mtime)
+    return response
+
 
 def page_not_found_view(request, exception):
     return render(request, '404.html', context={}, status=404)
@@ -109,3 +249,16 @@ def page_not_found_view(request, exception):
 
 def server_error_view(request):
     return render(request, '50x.html', context={}, status=500)
+
+
+@staff_member_required
+def slow_requests_view(request):
+    """后台查看ServerTimingMiddleware记录的最近的慢请求"""
+    context = dict(
+        admin.site.each_context(request),
+        title='慢请求',
+        slow_requests=get_slow_requests(),
+        threshold=settings.SLOW_REQUEST_THRESHOLD,
+        enabled=settings.SERVER_TIMING,
+    )
+    return render(request, 'admin/slow_requests.html', context)
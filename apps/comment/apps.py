@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CommentConfig(AppConfig):
     name = 'apps.comment'
     verbose_name = "用户评论"
+
+    def ready(self):
+        from . import signals  # noqa: F401
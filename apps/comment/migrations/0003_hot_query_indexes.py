@@ -0,0 +1,21 @@
+# Generated by Django 3.0.7 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comment', '0002_auto_20200618_1409'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['article', 'parent_comment', 'is_deleted'], name='comment_article_tree_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['is_deleted', '-created_time'], name='comment_latest_idx'),
+        ),
+    ]
@@ -1,8 +1,12 @@
+from django.core.paginator import Paginator
 from django.db import models
 from django.conf import settings
 
 from apps.blog.models import Article
 
+# 逐层查询回复时每条查询的上级评论数目
+REPLY_BATCH_SIZE = 500
+
 
 class Comment(models.Model):
     """用户评论"""
@@ -17,6 +21,12 @@ class Comment(models.Model):
     class Meta:
         verbose_name = "评论"
         verbose_name_plural = verbose_name
+        indexes = [
+            # 文章的评论树
+            models.Index(fields=['article', 'parent_comment', 'is_deleted'], name='comment_article_tree_idx'),
+            # latest_comments
+            models.Index(fields=['is_deleted', '-created_time'], name='comment_latest_idx'),
+        ]
 
     def __str__(self):
         return self.content
@@ -39,6 +49,8 @@ class Comment(models.Model):
         """
         将指定Article实例的某个Comment实例的子评论生成树形结构，
         如果不指定Comment实例，则生成Article实例所有评论的树形结构
+        该文章所有未删除的评论（连同作者）只用一次查询取出，再在内存中组装成树，
+        父评论已删除的评论不会出现在树中
         返回结构示例：
         [
             {
@@ -67,15 +79,76 @@ class Comment(models.Model):
         :param comment: Comment实例，可以不指定，默认为None
         :return: list
         """
-        tree = []
-        objects = cls.objects.filter(article=article, parent_comment=comment, is_deleted=False)
-        for obj in objects:
-            if obj.has_child:
-                subordinate = cls.get_comment_tree(article, obj)
-            else:
-                subordinate = []
-            tree.append({
-                'current': obj,
-                'subordinate': subordinate,
-            })
-        return tree
+        objects = cls.objects.filter(article=article, is_deleted=False).select_related('author')
+        children = {}
+        for obj in sorted(objects, key=lambda c: c.id):
+            children.setdefault(obj.parent_comment_id, []).append(obj)
+        return cls.build_comment_tree(children, comment.id if comment else None)
+
+    @classmethod
+    def get_thread_page(cls, article, page=None, per_page=10):
+        """
+        按顶层评论分页，每页包含per_page个顶层评论及其全部回复
+        只查询这一页的顶层评论，再逐层查询它们的回复，每一层一次查询，不加载文章的其他评论
+        :param article: Article实例
+        :param page: 页码，无效时返回第一页或最后一页
+        :param per_page: 每页顶层评论的数目
+        :return: Page，object_list为按深度优先展开的一维列表，结构示例：
+            [
+                {'current': obj, 'depth': 0},
+                {'current': obj, 'depth': 1},
+                {'current': obj, 'depth': 0},
+            ]
+        """
+        threads = cls.objects.filter(article=article, parent_comment=None, is_deleted=False).select_related(
+            'author').order_by('id')
+        page_obj = Paginator(threads, per_page).get_page(page)
+        children = {None: list(page_obj.object_list)}
+        parent_ids = [obj.id for obj in children[None]]
+        while parent_ids:
+            replies = []
+            # 分批查询，避免超过SQLite单条语句的参数数目限制
+            for i in range(0, len(parent_ids), REPLY_BATCH_SIZE):
+                replies.extend(cls.objects.filter(
+                    article=article, parent_comment__in=parent_ids[i:i + REPLY_BATCH_SIZE], is_deleted=False
+                ).select_related('author'))
+            # 在内存中排序，查询本身不排序
+            replies.sort(key=lambda c: c.id)
+            for obj in replies:
+                children.setdefault(obj.parent_comment_id, []).append(obj)
+            parent_ids = [obj.id for obj in replies]
+        page_obj.object_list = cls.flatten_comment_tree(cls.build_comment_tree(children, None))
+        return page_obj
+
+    def get_depth(self):
+        """评论的层级，顶层评论为0，用一次查询取出文章所有评论的上级评论id后在内存中计算"""
+        if self.parent_comment_id is None:
+            return 0
+        parents = dict(Comment.objects.filter(article_id=self.article_id).values_list('id', 'parent_comment_id'))
+        depth = 0
+        parent_id = self.parent_comment_id
+        while parent_id is not None:
+            depth += 1
+            parent_id = parents.get(parent_id)
+        return depth
+
+    @staticmethod
+    def build_comment_tree(children, parent_id):
+        """
+        :param children: 上级评论id到回复列表的dict，顶层评论的键为None
+        :param parent_id: 从哪个评论的回复开始生成，None为所有顶层评论
+        """
+        return [{
+            'current': obj,
+            'subordinate': Comment.build_comment_tree(children, obj.id),
+        } for obj in children.get(parent_id, [])]
+
+    @staticmethod
+    def flatten_comment_tree(tree, depth=0):
+        result = []
+        stack = [(node, depth) for node in reversed(tree)]
+        while stack:
+            node, level = stack.pop()
+            result.append({'current': node['current'], 'depth': level})
+            stack.extend((child, level + 1) for child in reversed(node['subordinate']))
+        return result
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from utils.cache_version import bump_cache_version
+from .models import Comment
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def comment_changed(sender, **kwargs):
+    # 依赖评论数据的缓存（如最近评论侧边栏）随之失效
+    bump_cache_version('comment')
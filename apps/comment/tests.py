@@ -1,3 +1,124 @@
+from unittest import skipUnless
+
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.blog.models import Article, Category
+from apps.users.models import UserProfile
+from utils.query_plan import analyze_tables, find_executed_plan_problems, find_plan_problems, is_supported
+from .models import Comment
+
+
+@skipUnless(is_supported(), '只能检查SQLite和MySQL的执行计划')
+class CommentQueryPlanTestCase(TestCase):
+    """热点查询的执行计划中不应出现全表扫描和额外排序"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = UserProfile.objects.create_user('user', 'user@example.com', 'password')
+        category = Category.objects.create(name='分类', sort=1, owner=user)
+        Article.objects.bulk_create([
+            Article(title='标题%d' % i, content='正文', content_html='<p>正文</p>', category=category,
+                    author=user, is_published=True, pub_time=timezone.now())
+            for i in range(100)
+        ])
+        articles = list(Article.objects.all())
+        Comment.objects.bulk_create([
+            Comment(article=articles[i % len(articles)], content='评论%d' % i, author=user, is_deleted=i % 10 == 0)
+            for i in range(3000)
+        ])
+        cls.article = articles[0]
+        # 前300条评论各有一条回复，每条回复又有一条回复
+        Comment.objects.bulk_create([
+            Comment(article_id=comment.article_id, content='回复', author=user, parent_comment=comment)
+            for comment in Comment.objects.order_by('id')[:300]
+        ])
+        Comment.objects.bulk_create([
+            Comment(article_id=reply.article_id, content='回复的回复', author=user, parent_comment=reply)
+            for reply in Comment.objects.filter(parent_comment__isnull=False)
+        ])
+        analyze_tables(Article, Comment)
+
+    def assertNoPlanProblems(self, queryset):
+        self.assertEqual(find_plan_problems(queryset), [], str(queryset.query))
+
+    def assertNoExecutedPlanProblems(self, func):
+        self.assertEqual(find_executed_plan_problems(func), [])
+
+    def test_comment_tree(self):
+        # get_comment_tree在内存中排序，查询本身不排序
+        self.assertNoExecutedPlanProblems(lambda: Comment.get_comment_tree(self.article))
+
+    def test_thread_page(self):
+        self.assertNoExecutedPlanProblems(lambda: Comment.get_thread_page(self.article, 2))
+
+    def test_latest_comments(self):
+        self.assertNoPlanProblems(Comment.latest_comments(10))
+
+
+class CommentThreadTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create_user('user', 'user@example.com', 'password')
+        category = Category.objects.create(name='分类', sort=1, owner=cls.user)
+        cls.article = Article.objects.create(title='标题', content='正文', category=category, author=cls.user,
+                                             is_published=True)
+
+        def create(content, parent=None, is_deleted=False):
+            return Comment.objects.create(article=cls.article, content=content, author=cls.user,
+                                          parent_comment=parent, is_deleted=is_deleted)
+        cls.threads = [create('评论%d' % i) for i in range(12)]
+        cls.reply = create('回复', cls.threads[0])
+        cls.nested = create('回复的回复', cls.reply)
+        cls.second_reply = create('第二条回复', cls.threads[0])
+        deleted = create('已删除', cls.threads[1], is_deleted=True)
+        create('已删除评论的回复', deleted)
+        create('已删除', is_deleted=True)
+
+    def flatten(self, page):
+        return [(item['current'], item['depth']) for item in page.object_list]
+
+    def test_thread_page(self):
+        # 顶层评论计数、这一页的顶层评论、两层回复各一次查询，最后一次确认没有更深的回复
+        with self.assertNumQueries(5):
+            page = Comment.get_thread_page(self.article, 1, 10)
+        self.assertEqual(page.paginator.num_pages, 2)
+        self.assertEqual(self.flatten(page)[:5], [
+            (self.threads[0], 0), (self.reply, 1), (self.nested, 2), (self.second_reply, 1), (self.threads[1], 0)])
+        self.assertEqual(self.flatten(page)[5:], [(thread, 0) for thread in self.threads[2:10]])
+        # 与整篇文章的评论树展开后的前10个顶层评论一致
+        tree = Comment.flatten_comment_tree(Comment.get_comment_tree(self.article))
+        self.assertEqual(self.flatten(page), [(item['current'], item['depth']) for item in tree][:13])
+
+    def test_last_page(self):
+        page = Comment.get_thread_page(self.article, 'invalid', 10)
+        self.assertEqual(page.number, 1)
+        page = Comment.get_thread_page(self.article, 99, 10)
+        self.assertEqual(self.flatten(page), [(self.threads[10], 0), (self.threads[11], 0)])
+
+    def test_depth(self):
+        self.assertEqual(self.threads[0].get_depth(), 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.nested.get_depth(), 2)
+
+    def test_thread_view(self):
+        url = reverse('comment-threads', args=[self.article.id])
+        response = self.client.get(url)
+        self.assertEqual(response['X-Next-Page'], '2')
+        self.assertContains(response, 'commentBlock%d' % self.nested.id)
+        data = self.client.get(url, {'page': 2, 'format': 'json'}).json()
+        self.assertIsNone(data['next_page'])
+        self.assertEqual([comment['id'] for comment in data['comments']], [self.threads[10].id, self.threads[11].id])
 
-# Create your tests here.
+    def test_ajax_post(self):
+        self.client.force_login(self.user)
+        url = reverse('add-comment', args=[self.article.id])
+        response = self.client.post(url, {'content': '新回复', 'parent_comment': self.nested.id},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 201)
+        self.assertContains(response, 'data-depth="3"', status_code=201)
+        response = self.client.post(url, {'content': ''}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('content', response.json()['errors'])
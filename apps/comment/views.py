@@ -1,11 +1,62 @@
 from django.views.generic.base import View
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, HttpResponse, JsonResponse
+from django.template.loader import render_to_string
 from django.urls import reverse
 
 from apps.blog.models import Article
+from utils.images import thumbnail_url
 from .forms import CommentForm
+from .models import Comment
+
+# 每页加载的顶层评论数目
+THREADS_PER_PAGE = 10
+
+
+def render_comment_block(comment_list, request):
+    return render_to_string('comment/tags/block.html', {'comment_list': comment_list}, request)
+
+
+class CommentThreadView(View):
+    """
+    分页返回文章的评论，每页THREADS_PER_PAGE个顶层评论及其全部回复，文章详情页通过ajax按需加载
+    format=html（默认）返回渲染好的评论片段，下一页的页码在响应头X-Next-Page中；format=json返回评论数据
+    """
+
+    def get(self, request, article_id, *args, **kwargs):
+        article = get_object_or_404(Article.objects.only('id'), id=article_id, is_published=True)
+        page = Comment.get_thread_page(article, request.GET.get('page'), THREADS_PER_PAGE)
+        next_page = page.next_page_number() if page.has_next() else None
+
+        if request.GET.get('format') == 'json':
+            return JsonResponse({
+                'page': page.number,
+                'num_pages': page.paginator.num_pages,
+                'next_page': next_page,
+                'thread_count': page.paginator.count,
+                'comments': [self.serialize(item['current'], item['depth']) for item in page.object_list],
+            })
+
+        response = HttpResponse(render_comment_block(page.object_list, request))
+        if next_page:
+            response['X-Next-Page'] = next_page
+        return response
+
+    @staticmethod
+    def serialize(comment, depth):
+        return {
+            'id': comment.id,
+            'parent_id': comment.parent_comment_id,
+            'depth': depth,
+            'content': comment.content,
+            'created_time': comment.created_time.isoformat(),
+            'author': {
+                'id': comment.author.id,
+                'name': str(comment.author),
+                'image': thumbnail_url(comment.author.image, 48),
+            },
+        }
 
 
 class AddCommentView(LoginRequiredMixin, View):
@@ -13,15 +64,21 @@ class AddCommentView(LoginRequiredMixin, View):
 
     def post(self, request, article_id, *args, **kwargs):
         comment_form = CommentForm(request.POST)
-        instance_id = 0
+        instance = None
         if comment_form.is_valid():
             instance = comment_form.save(commit=False)
             instance.article = get_object_or_404(Article, id=article_id)
             instance.author = request.user
             instance.save()
-            instance_id = instance.id
+
+        # ajax提交时只返回新评论的片段，页面无需重新加载
+        if request.is_ajax():
+            if instance is None:
+                return JsonResponse({'errors': comment_form.errors.get_json_data()}, status=400)
+            comment_list = [{'current': instance, 'depth': instance.get_depth()}]
+            return HttpResponse(render_comment_block(comment_list, request), status=201)
 
         return HttpResponseRedirect(
             reverse("article-detail", kwargs={'article_id': article_id}) +
-            ("#commentBlock" + str(instance_id)) if instance_id else ""
+            ("#commentBlock" + str(instance.id) if instance else "")
         )
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ConfigConfig(AppConfig):
     name = 'apps.config'
     verbose_name = "博客配置"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -1,12 +1,16 @@
 import os
-import hashlib
 
 from django.db import models
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
+from utils.cache_version import get_cache_version, get_cache_versions
+from utils.images import file_md5
+
 
 class Link(models.Model):
     """友情链接"""
@@ -58,8 +62,31 @@ class SideBar(models.Model):
     def __str__(self):
         return self.title
 
+    @classmethod
+    def get_enabled(cls):
+        """启用的侧边栏，侧边栏保存或删除后缓存失效"""
+        version = get_cache_version('sidebar')
+        sidebars = cache.get('sidebars', version=version)
+        if sidebars is None:
+            sidebars = list(cls.objects.filter(is_enable=True))
+            cache.set('sidebars', sidebars, version=version)
+        return sidebars
+
     def content_html(self):
-        """渲染模板"""
+        """渲染模板，渲染结果按所依赖数据的版本号缓存，依赖的数据保存或删除后缓存失效"""
+        if self.type == self.DisplayType.HTML:
+            return self.content
+
+        key = 'sidebar:%s:%s' % (self.type, get_cache_versions(*SIDEBAR_DEPENDENCIES[self.type]))
+        result = cache.get(key)
+        if result is None:
+            result = self.render_content()
+            # 阅读量的变化不会触发缓存失效，最热文章需要定时刷新
+            timeout = 10 * 60 if self.type == self.DisplayType.HOTTEST_ARTICLES else DEFAULT_TIMEOUT
+            cache.set(key, result, timeout)
+        return result
+
+    def render_content(self):
         from apps.blog.models import Article, Tag  # 避免循环引用
         from apps.comment.models import Comment
         from utils.blog_setting import get_blog_setting
@@ -69,7 +96,7 @@ class SideBar(models.Model):
             result = self.content
         elif self.type == self.DisplayType.TAGS:
             context = {
-                'tags': Tag.objects.filter(is_deleted=False).order_by('created_time')
+                'tags': Tag.with_article_count().order_by('created_time')
             }
             result = render_to_string('config/blocks/sidebar_tags.html', context)
         elif self.type == self.DisplayType.LATEST_ARTICLES:
@@ -95,11 +122,20 @@ class SideBar(models.Model):
         return result
 
 
+# 各类侧边栏所依赖的数据，对应的模型保存或删除时会更新版本号
+SIDEBAR_DEPENDENCIES = {
+    SideBar.DisplayType.TAGS: ('sidebar', 'tag', 'article'),
+    SideBar.DisplayType.LATEST_ARTICLES: ('sidebar', 'article', 'blog_setting'),
+    SideBar.DisplayType.HOTTEST_ARTICLES: ('sidebar', 'article', 'blog_setting'),
+    SideBar.DisplayType.LATEST_COMMENTS: ('sidebar', 'comment', 'article', 'blog_setting'),
+    SideBar.DisplayType.LINK: ('sidebar', 'link'),
+}
+
+
 def background_image_path(instance, filename):
-    content = instance.background_image.file.read()
     ext = filename.split('.')[-1]
     # 将上传的图片文件命名为md5值
-    filename = '{}.{}'.format(hashlib.md5(content).hexdigest(), ext)
+    filename = '{}.{}'.format(file_md5(instance.background_image.file), ext)
     return os.path.join("background_image", filename)
 
 
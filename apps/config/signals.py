@@ -0,0 +1,41 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from utils.cache_version import bump_cache_version
+from utils.blog_setting import get_blog_setting, reset_blog_setting
+from utils.images import generate_background_variants
+from .models import Link, SideBar, BlogSettings
+
+
+@receiver([post_save, post_delete], sender=Link)
+def link_changed(sender, **kwargs):
+    bump_cache_version('link')
+
+
+@receiver([post_save, post_delete], sender=SideBar)
+def sidebar_changed(sender, **kwargs):
+    bump_cache_version('sidebar')
+
+
+@receiver([pre_save, pre_delete], sender=BlogSettings)
+def blog_settings_changing(sender, instance, **kwargs):
+    # 记下修改前生效的文章摘要长度
+    reset_blog_setting()
+    instance._previous_sub_length = get_blog_setting()['article_sub_length']
+
+
+@receiver([post_save, post_delete], sender=BlogSettings)
+def blog_settings_changed(sender, instance, signal, **kwargs):
+    # 先生成背景图片的缩略图，重新读取的网站配置中才会引用缩略图
+    if signal is post_save:
+        generate_background_variants(instance.background_image)
+
+    # 更新版本号，各进程的网站配置快照随之失效
+    bump_cache_version('blog_setting')
+    reset_blog_setting()
+
+    # 文章摘要长度变化后重新生成所有文章的摘录
+    from apps.blog.models import Article  # 避免循环引用
+    sub_length = get_blog_setting()['article_sub_length']
+    if sub_length != getattr(instance, '_previous_sub_length', sub_length):
+        Article.rebuild_excerpts(sub_length)
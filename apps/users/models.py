@@ -1,15 +1,15 @@
 import os
-import hashlib
 
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
+from utils.images import file_md5
+
 
 def user_image_path(instance, filename):
-    content = instance.image.file.read()
     ext = filename.split('.')[-1]
     # 将上传的图片文件命名为md5值
-    filename = '{}.{}'.format(hashlib.md5(content).hexdigest(), ext)
+    filename = '{}.{}'.format(file_md5(instance.image.file), ext)
     return os.path.join("head_image", str(instance.id), filename)
 
 
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from utils.images import generate_avatar_variants
+from .models import UserProfile
+
+
+@receiver(post_save, sender=UserProfile)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # 登录时只更新last_login，头像没有变化
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    generate_avatar_variants(instance.image)
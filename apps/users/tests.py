@@ -1,3 +1,79 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase
+
+from utils import images
+
+
+class ImageVariantTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.storage = FileSystemStorage(location=directory)
+
+    def make_image(self, name, size=(200, 100), image_format='PNG', mode='RGB'):
+        buffer = io.BytesIO()
+        Image.new(mode, size, 'red').save(buffer, image_format)
+        return SimpleNamespace(storage=self.storage, name=self.storage.save(name, ContentFile(buffer.getvalue())))
+
+    def open_variant(self, field_file, size):
+        return Image.open(self.storage.open(images.variant_name(field_file.name, size)))
+
+    def test_avatar_variants(self):
+        field_file = self.make_image('avatar.png')
+        self.assertEqual(images.generate_avatar_variants(field_file), 2)
+        self.assertEqual(self.open_variant(field_file, 48).size, (48, 48))
+        self.assertEqual(self.open_variant(field_file, 96).size, (96, 96))
+        # 已经生成过的不会重新生成
+        self.assertEqual(images.generate_avatar_variants(field_file), 0)
+
+    def test_background_variants_are_not_upscaled(self):
+        field_file = self.make_image('background.jpg', (1000, 500), 'JPEG')
+        self.assertEqual(images.generate_background_variants(field_file), 3)
+        self.assertEqual(self.open_variant(field_file, 640).size, (640, 320))
+        self.assertEqual(self.open_variant(field_file, 1920).size, (1000, 500))
+
+    def test_thumbnail_url_caches_missing_variants(self):
+        field_file = self.make_image('avatar_missing.png')
+        field_file.url = self.storage.url(field_file.name)
+        with mock.patch.object(self.storage, 'exists', wraps=self.storage.exists) as exists:
+            for i in range(3):
+                self.assertEqual(images.thumbnail_url(field_file, 48), field_file.url)
+            self.assertEqual(exists.call_count, 1)
+        images.generate_avatar_variants(field_file)
+        self.assertEqual(images.thumbnail_url(field_file, 48),
+                         self.storage.url(images.variant_name(field_file.name, 48)))
+
+    def test_invalid_images_are_skipped(self):
+        field_file = SimpleNamespace(storage=self.storage, name=self.storage.save('bad.png', ContentFile(b'not png')))
+        with self.assertLogs('utils.images', 'WARNING'):
+            self.assertEqual(images.generate_avatar_variants(field_file), 0)
+        with self.assertLogs('utils.images', 'WARNING'):
+            self.assertEqual(images.generate_avatar_variants(
+                SimpleNamespace(storage=self.storage, name='missing.png')), 0)
+
+    def test_decompression_bomb_is_skipped(self):
+        field_file = self.make_image('bomb.png')
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 100), self.assertLogs('utils.images', 'WARNING'):
+            self.assertEqual(images.generate_avatar_variants(field_file), 0)
+
+    def test_unwritable_format_falls_back(self):
+        encode = images._encode
+
+        def unwritable_png(variant, image_format):
+            if image_format == 'PNG':
+                raise KeyError(image_format)
+            return encode(variant, image_format)
+
+        field_file = self.make_image('avatar.png')
+        with mock.patch.object(images, '_encode', unwritable_png):
+            self.assertEqual(images.generate_avatar_variants(field_file), 2)
+        self.assertEqual(self.open_variant(field_file, 48).format, 'JPEG')
@@ -8,9 +8,14 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
 
 import os
+import atexit
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_blog.settings')
 
 application = get_asgi_application()
+
+# worker正常退出时把缓冲的文章访问计数写回数据库
+from apps.blog.counters import flush_on_exit  # noqa: E402
+atexit.register(flush_on_exit)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 import environ
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -63,6 +64,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.blog.middleware.server_timing.ServerTimingMiddleware',
     'apps.blog.middleware.user_id.UserIDMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -71,6 +73,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.blog.middleware.page_cache.PageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'django_blog.urls'
@@ -147,15 +150,42 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'collect_static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
+# 上传文件交给前端服务器发送：''（由Django发送）、'x-accel-redirect'（nginx）或'x-sendfile'（apache、lighttpd）
+MEDIA_SENDFILE = env('MEDIA_SENDFILE', default='')
+# X-Accel-Redirect指向的nginx internal location
+MEDIA_ACCEL_REDIRECT_PREFIX = env('MEDIA_ACCEL_REDIRECT_PREFIX', default='/protected-media/')
 
+# 基于内存映射文件的缓存，同一台机器上的所有uwsgi进程共享，见utils/mmap_cache.py
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'utils.mmap_cache.MmapCache',
         'TIMEOUT': 10800,
-        'LOCATION': 'backend-cache',
+        'LOCATION': env('CACHE_LOCATION', default=os.path.join(
+            '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'django_blog.cache')),
+        'OPTIONS': {
+            'MAX_SIZE': env.int('CACHE_MAX_SIZE', 64 * 1024 * 1024),
+            # 缓存版本号和还没有写回数据库的文章pv/uv不会被淘汰
+            'PINNED_KEY_PREFIXES': ('version:', 'article_counter:'),
+        },
     }
 }
 
+# 文章pv/uv增量写回数据库的间隔（秒）
+ARTICLE_COUNTER_FLUSH_INTERVAL = env.int('ARTICLE_COUNTER_FLUSH_INTERVAL', 60)
+
+# 匿名用户整页缓存的有效期（秒），相关数据变化时会提前失效
+PAGE_CACHE_TIMEOUT = env.int('PAGE_CACHE_TIMEOUT', 10 * 60)
+
+# 预先生成的sitemap文件存放的目录
+SITEMAP_ROOT = env('SITEMAP_ROOT', default=os.path.join(BASE_DIR, 'sitemap'))
+
+# 是否在响应头Server-Timing中返回请求各部分的耗时，并记录慢请求
+SERVER_TIMING = env.bool('SERVER_TIMING', False)
+# 超过该耗时（毫秒）的请求记录为慢请求
+SLOW_REQUEST_THRESHOLD = env.int('SLOW_REQUEST_THRESHOLD', 500)
+# 保留的最慢请求条数
+SLOW_REQUEST_LOG_SIZE = env.int('SLOW_REQUEST_LOG_SIZE', 50)
+
 # django-mdeditor设置
 X_FRAME_OPTIONS = 'SAMEORIGIN'
 
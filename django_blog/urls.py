@@ -15,34 +15,37 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, re_path, include
-from django.views.static import serve
 from django.conf import settings
-from django.contrib.sitemaps import views as sitemap_views
 from django.views.generic import TemplateView
 
-from apps.blog.rss import LatestPostFeed
-from apps.blog.sitemap import ArticleSitemap
+from apps.blog.rss import LatestPostFeed, CategoryFeed, TagFeed
 
-from apps.blog.views import ArticleListView, ArticleDetailView, ArticleArchivesView
+from apps.blog.views import ArticleListView, ArticleDetailView, ArticleArchivesView, slow_requests_view, sitemap_view
 from apps.users.views import ProfileView
-from apps.comment.views import AddCommentView
+from apps.comment.views import AddCommentView, CommentThreadView
+from utils.media import serve_media
 
 handler404 = 'apps.blog.views.page_not_found_view'
 handler500 = 'apps.blog.views.server_error_view'
 
 
 urlpatterns = [
+    path('admin/slow-requests/', slow_requests_view, name='slow-requests'),
     path('admin/', admin.site.urls),
     path('', ArticleListView.as_view(), name='article-list'),
     path('accounts/', include('allauth.urls')),
     path('accounts/profile/<int:user_id>/', ProfileView.as_view(), name="profile"),
     path('article/<int:article_id>/', ArticleDetailView.as_view(), name='article-detail'),
+    path('article/<int:article_id>/comments/', CommentThreadView.as_view(), name='comment-threads'),
     path('add_comment/<int:article_id>/', AddCommentView.as_view(), name='add-comment'),
     path('archives/', ArticleArchivesView.as_view(), name='article-archives'),
     path('rss/', LatestPostFeed(), name='rss'),
-    path('sitemap.xml', sitemap_views.sitemap, {'sitemaps': {'articles': ArticleSitemap}}, name='sitemap'),
+    path('rss/category/<int:category_id>/', CategoryFeed(), name='category-rss'),
+    path('rss/tag/<int:tag_id>/', TagFeed(), name='tag-rss'),
+    path('sitemap.xml', sitemap_view, name='sitemap'),
+    path('sitemap-<int:page>.xml', sitemap_view, name='sitemap-shard'),
     path('mdeditor/', include('mdeditor.urls')),
 
     # 配置上传文件的访问url
-    re_path(r'^media/(?P<path>.*)$', serve, {"document_root": settings.MEDIA_ROOT}),
+    re_path(r'^media/(?P<path>.*)$', serve_media, {"document_root": settings.MEDIA_ROOT}),
 ]
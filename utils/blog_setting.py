@@ -1,38 +1,76 @@
-from django.core.cache import cache
+import threading
+
+from django.core.signals import request_started
+
 from apps.config.models import BlogSettings
+from utils.cache_version import get_cache_version
+from utils.images import thumbnail_url, BACKGROUND_WIDTHS
+
+# 每个进程保存一份网站配置的快照：(版本号, 配置)
+_snapshot = None
+# 当前线程处理的请求是否已经检查过版本号
+_local = threading.local()
+
+
+def _reset_checked(**kwargs):
+    _local.checked = False
+
+
+request_started.connect(_reset_checked)
+
+
+def reset_blog_setting():
+    """使下一次get_blog_setting重新检查版本号，用于在请求之外（如信号处理）读取最新配置"""
+    _reset_checked()
 
 
 def get_blog_setting():
-    value = cache.get('blog_setting')
-    if value:
-        return value
+    """
+    获取网站配置，返回进程内的快照，每个请求最多检查一次缓存中的版本号，
+    后台修改BlogSettings后版本号变化（见apps/config/signals.py），各进程在下一个请求重新读取，无需重启
+    """
+    global _snapshot
+    if _snapshot is not None and getattr(_local, 'checked', False):
+        return _snapshot[1]
+
+    version = get_cache_version('blog_setting')
+    if _snapshot is None or _snapshot[0] != version:
+        _snapshot = (version, load_blog_setting())
+    _local.checked = True
+    return _snapshot[1]
+
+
+def load_blog_setting():
+    blog_setting = BlogSettings.objects.filter(is_enable=True).first()
+    if blog_setting:
+        value = {
+            'site_name': blog_setting.site_name,
+            'site_description': blog_setting.site_description,
+            # 背景图片默认使用1280像素宽的缩略图，background_image_srcset供浏览器按屏幕宽度选择
+            'background_image': thumbnail_url(blog_setting.background_image, 1280),
+            'background_image_srcset': ', '.join(
+                '%s %dw' % (thumbnail_url(blog_setting.background_image, width), width) for width in BACKGROUND_WIDTHS
+            ) if blog_setting.background_image else '',
+            'per_page_count': blog_setting.per_page_count,
+            'article_sub_length': blog_setting.article_sub_length,
+            'sidebar_article_count': blog_setting.sidebar_article_count,
+            'sidebar_comment_count': blog_setting.sidebar_comment_count,
+            'open_site_comment': blog_setting.open_site_comment,
+            'theme': blog_setting.theme,
+            'record_number': blog_setting.record_number,
+        }
     else:
-        blog_settings = BlogSettings.objects.filter(is_enable=True)
-        if blog_settings:
-            value = {
-                'site_name': blog_settings[0].site_name,
-                'site_description': blog_settings[0].site_description,
-                'background_image': blog_settings[0].background_image.url,
-                'per_page_count': blog_settings[0].per_page_count,
-                'article_sub_length': blog_settings[0].article_sub_length,
-                'sidebar_article_count': blog_settings[0].sidebar_article_count,
-                'sidebar_comment_count': blog_settings[0].sidebar_comment_count,
-                'open_site_comment': blog_settings[0].open_site_comment,
-                'theme': blog_settings[0].theme,
-                'record_number': blog_settings[0].record_number,
-            }
-        else:
-            value = {
-                'site_name': '一个博客',
-                'site_description': '这是一个用Django开发的博客',
-                'background_image': '',
-                'per_page_count': 10,
-                'article_sub_length': 200,
-                'sidebar_article_count': 5,
-                'sidebar_comment_count': 5,
-                'open_site_comment': True,
-                'theme': 1,
-                'record_number': '还没有备案',
-            }
-        cache.set('blog_setting', value, 30 * 60)
-        return value
+        value = {
+            'site_name': '一个博客',
+            'site_description': '这是一个用Django开发的博客',
+            'background_image': '',
+            'background_image_srcset': '',
+            'per_page_count': 10,
+            'article_sub_length': 200,
+            'sidebar_article_count': 5,
+            'sidebar_comment_count': 5,
+            'open_site_comment': True,
+            'theme': 1,
+            'record_number': '还没有备案',
+        }
+    return value
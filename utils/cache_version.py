@@ -0,0 +1,33 @@
+import time
+
+from django.core.cache import cache
+
+
+def _version_key(name):
+    return 'version:%s' % name
+
+
+def get_cache_version(name):
+    """
+    获取名为name的缓存数据版本号，数据变化时调用bump_cache_version使旧缓存失效
+    版本号取自当前时间，缓存被清空后重新生成的版本号也不会与旧版本重复
+    """
+    version = cache.get(_version_key(name))
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(_version_key(name), version, None):
+            version = cache.get(_version_key(name), version)
+    return version
+
+
+def bump_cache_version(name):
+    """使名为name的缓存数据失效"""
+    version = max(int(time.time() * 1000), cache.get(_version_key(name), 0) + 1)
+    cache.set(_version_key(name), version, None)
+    return version
+
+
+def get_cache_versions(*names):
+    """将多个缓存数据的版本号拼成一个字符串，用于依赖多种数据的缓存"""
+    versions = cache.get_many([_version_key(name) for name in names])
+    return ':'.join(str(versions.get(_version_key(name)) or get_cache_version(name)) for name in names)
@@ -0,0 +1,70 @@
+import math
+import hashlib
+
+
+class HyperLogLog:
+    """
+    HyperLogLog基数估计：用2^p个单字节寄存器估计不重复元素的个数，
+    占用内存固定为2^p字节，与加入多少元素无关。
+    相对标准误差约为1.04/sqrt(2^p)，默认p=10时占用1KB，标准误差约3.25%，
+    约99.7%的估计值落在真实值±9.75%以内；元素较少（n<2.5*2^p）时使用线性计数，误差更小。
+    多个HyperLogLog按寄存器取最大值即可合并，合并结果等价于对所有元素一起统计。
+    """
+
+    def __init__(self, p=10, registers=None):
+        if not 4 <= p <= 16:
+            raise ValueError('p must be between 4 and 16')
+        self.p = p
+        self.m = 1 << p
+        if registers is None:
+            self.registers = bytearray(self.m)
+        else:
+            if len(registers) != self.m:
+                raise ValueError('registers size does not match p')
+            self.registers = bytearray(registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(p=len(data).bit_length() - 1, registers=data)
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    @property
+    def error_rate(self):
+        """相对标准误差"""
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, value):
+        """
+        加入一个元素
+        :return: 寄存器是否发生变化，未变化说明估计值不变
+        """
+        x = int.from_bytes(hashlib.sha1(str(value).encode('utf-8')).digest()[:8], 'big')
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        if other.m != self.m:
+            raise ValueError('cannot merge HyperLogLog with different precision')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        if self.m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / self.m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.m]
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # 小范围修正：线性计数
+            estimate = self.m * math.log(self.m / zeros)
+        return estimate
+
+    def __len__(self):
+        return int(round(self.count()))
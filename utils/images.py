@@ -0,0 +1,136 @@
+"""
+上传图片的哈希命名和缩略图
+
+头像生成48px、96px的正方形缩略图，背景图片生成640、1280、1920像素宽的缩略图，
+缩略图与原图放在同一目录，文件名为原文件名加尺寸，如head_image/2/<md5>_48.jpg
+"""
+import io
+import os
+import time
+import hashlib
+import logging
+
+from PIL import Image, ImageOps
+from django.core.files.base import ContentFile
+
+AVATAR_SIZES = (48, 96)
+BACKGROUND_WIDTHS = (640, 1280, 1920)
+JPEG_QUALITY = 85
+
+logger = logging.getLogger(__name__)
+
+# 已经确认存在的缩略图，避免每次渲染都访问文件系统
+_existing_variants = set()
+# 确认不存在的缩略图及确认的时间，MISSING_VARIANT_TIMEOUT秒内不再检查，
+# 本进程生成缩略图时清除，其他进程生成的缩略图最多晚这么久才会用上
+_missing_variants = {}
+MISSING_VARIANT_TIMEOUT = 60
+
+
+def file_md5(file, chunk_size=64 * 1024):
+    """分块计算上传文件的md5，不把整个文件读入内存"""
+    md5 = hashlib.md5()
+    for chunk in file.chunks(chunk_size):
+        md5.update(chunk)
+    file.seek(0)
+    return md5.hexdigest()
+
+
+def variant_name(name, size):
+    stem, ext = os.path.splitext(name)
+    return '%s_%d%s' % (stem, size, ext)
+
+
+def thumbnail_url(field_file, size):
+    """缩略图的url，缩略图还没有生成时返回原图的url"""
+    if not field_file:
+        return ''
+    name = variant_name(field_file.name, size)
+    if name not in _existing_variants:
+        checked = _missing_variants.get(name)
+        if checked is not None and time.monotonic() - checked < MISSING_VARIANT_TIMEOUT:
+            return field_file.url
+        if not field_file.storage.exists(name):
+            _missing_variants[name] = time.monotonic()
+            return field_file.url
+        _existing_variants.add(name)
+        _missing_variants.pop(name, None)
+    return field_file.storage.url(name)
+
+
+def generate_avatar_variants(field_file, force=False):
+    return generate_variants(field_file, AVATAR_SIZES, square=True, force=force)
+
+
+def generate_background_variants(field_file, force=False):
+    return generate_variants(field_file, BACKGROUND_WIDTHS, square=False, force=force)
+
+
+def generate_variants(field_file, sizes, square, force=False):
+    """
+    生成缩略图，square为True时居中裁剪成正方形，否则按宽度等比缩放（不放大）
+    文件名包含内容哈希，已存在的缩略图不会重新生成，除非force为True
+    :return: 生成的缩略图数目
+    """
+    if not field_file:
+        return 0
+    storage = field_file.storage
+    names = {size: variant_name(field_file.name, size) for size in sizes}
+    if not force:
+        names = {size: name for size, name in names.items() if not storage.exists(name)}
+    if not names:
+        return 0
+    # 在post_save中调用，任何图片的问题都不能让已经保存的请求返回500
+    generated = 0
+    try:
+        with storage.open(field_file.name, 'rb') as f:
+            image = Image.open(f)
+            image.load()
+
+        image_format = image.format or Image.registered_extensions().get(
+            os.path.splitext(field_file.name)[1].lower(), 'JPEG')
+        # 按照EXIF中的方向旋转，手机拍摄的照片不会横过来
+        image = ImageOps.exif_transpose(image)
+        for size, name in names.items():
+            if square:
+                variant = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            elif image.width > size:
+                variant = image.resize((size, round(image.height * size / image.width)), Image.LANCZOS)
+            else:
+                variant = image.copy()
+            data = encode_variant(variant, image_format)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(data))
+            _existing_variants.add(name)
+            _missing_variants.pop(name, None)
+            generated += 1
+    except (OSError, ValueError, KeyError, Image.DecompressionBombError):
+        # 原图不存在、不是有效的图片、像素过多（解压炸弹）或无法编码
+        logger.warning('cannot generate variants of %s', field_file.name, exc_info=True)
+    return generated
+
+
+def encode_variant(variant, image_format):
+    """
+    按原图的格式编码缩略图，Pillow不能写入该格式或模式时（如旧版本Pillow的MPO）
+    有透明通道的改用PNG，其余改用JPEG
+    """
+    try:
+        return _encode(variant, image_format)
+    except (OSError, ValueError, KeyError):
+        has_alpha = 'A' in variant.getbands() or 'transparency' in variant.info
+        fallback = 'PNG' if has_alpha else 'JPEG'
+        if fallback == image_format:
+            raise
+        logger.info('cannot save variant as %s, using %s', image_format, fallback)
+        return _encode(variant, fallback)
+
+
+def _encode(variant, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        variant.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        variant.save(buffer, image_format, optimize=True)
+    return buffer.getvalue()
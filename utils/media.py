@@ -0,0 +1,141 @@
+"""
+上传文件（MEDIA_ROOT）的访问视图，替代django.views.static.serve
+
+MEDIA_SENDFILE为'x-accel-redirect'或'x-sendfile'时，视图只检查文件并返回响应头，
+文件内容由前端的nginx（X-Accel-Redirect）或apache/lighttpd（X-Sendfile）发送，不占用Python进程；
+nginx需要配置对应的internal location，例如：
+    location /protected-media/ {
+        internal;
+        alias /path/to/uploads/;
+    }
+未配置时由Django分块发送，支持单个Range请求和If-Modified-Since
+"""
+import os
+import re
+import stat
+import mimetypes
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.static import was_modified_since
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# 文件名中包含md5等内容哈希的文件内容不会变化，可以长期缓存
+HASHED_NAME_RE = re.compile(r'(^|[._-])[0-9a-f]{32}([._-]|$)')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DEFAULT_CACHE_CONTROL = 'public, max-age=3600'
+
+
+def serve_media(request, path, document_root=None):
+    document_root = document_root or settings.MEDIA_ROOT
+    try:
+        fullpath = safe_join(document_root, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        statobj = os.stat(fullpath)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not stat.S_ISREG(statobj.st_mode):
+        raise Http404
+
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), statobj.st_mtime, statobj.st_size):
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_SENDFILE:
+        response = sendfile_response(fullpath, document_root)
+    else:
+        response = file_response(request, fullpath, statobj)
+
+    response['Last-Modified'] = http_date(statobj.st_mtime)
+    is_hashed = HASHED_NAME_RE.search(os.path.splitext(os.path.basename(fullpath))[0])
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if is_hashed else DEFAULT_CACHE_CONTROL
+    return response
+
+
+def sendfile_response(fullpath, document_root):
+    """响应体为空，由前端服务器根据响应头发送文件"""
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    response = HttpResponse(content_type=content_type or 'application/octet-stream')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        relative = os.path.relpath(fullpath, os.path.abspath(document_root)).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + relative)
+    elif settings.MEDIA_SENDFILE == 'x-sendfile':
+        response['X-Sendfile'] = fullpath
+    else:
+        raise ValueError('MEDIA_SENDFILE只能是x-accel-redirect或x-sendfile：%s' % settings.MEDIA_SENDFILE)
+    return response
+
+
+def file_response(request, fullpath, statobj):
+    size = statobj.st_size
+    byte_range = parse_range(request, statobj)
+    if byte_range is None:
+        # FileResponse分块读取文件，uwsgi等服务器支持wsgi.file_wrapper时使用sendfile发送
+        response = FileResponse(open(fullpath, 'rb'))
+    elif byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(fullpath, start, end - start + 1), status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Content-Length'] = str(end - start + 1)
+        content_type, encoding = mimetypes.guess_type(fullpath)
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def parse_range(request, statobj):
+    """
+    解析Range请求头，只支持单个区间
+    :return: 不需要按区间返回时为None，区间无法满足时为False，否则为(起始, 结束)，结束位置包含在内
+    """
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    # If-Range中的时间与文件修改时间不一致时返回整个文件
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and parse_http_date_safe(if_range) != int(statobj.st_mtime):
+        return None
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        # 多个区间或格式错误时忽略Range
+        return None
+
+    size = statobj.st_size
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-500表示最后500个字节
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def read_range(fullpath, start, length):
+    with open(fullpath, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
@@ -0,0 +1,355 @@
+"""
+基于内存映射文件的缓存后端，同一台机器上的多个uwsgi进程共享同一份缓存
+
+配置示例：
+CACHES = {
+    'default': {
+        'BACKEND': 'utils.mmap_cache.MmapCache',
+        'LOCATION': '/dev/shm/django_blog.cache',
+        'OPTIONS': {
+            'MAX_SIZE': 64 * 1024 * 1024,
+            'PINNED_KEY_PREFIXES': ('version:',),
+            'PINNED_MAX_SHARE': 0.5,
+        },
+    }
+}
+
+文件大小固定为MAX_SIZE，按SLOT_SIZES平均分成若干区域，每个区域由同样大小的槽组成，
+值按序列化（必要时压缩）后的大小放进所有能容纳它的区域，小的值优先放进小的槽，小槽不够用时可以使用大槽。
+键的哈希决定它在每个区域中的位置，向后探测PROBE_LENGTH个槽，都被占用时淘汰其中最久未访问的一个（近似LRU）。
+键以PINNED_KEY_PREFIXES中的前缀开头时不会被淘汰（仍然会过期、可以删除），用于版本号、计数器等丢失后代价很大的数据，
+没有可用的槽时写入失败。每个探测范围内固定的键最多占PINNED_MAX_SHARE比例的槽，固定的键再多也不会占满缓存。
+所有操作都在文件锁（进程间）和线程锁（进程内）内完成，incr等读-改-写操作是原子的。
+Django为每个线程创建一个缓存实例，同一进程内的实例共用一个文件描述符、映射和线程锁。
+写入时先写值再写槽头，进程在写入过程中被杀死不会留下内容不完整的槽，无法解析的槽读取时被释放，视为未命中。
+超过最大槽的值不会被缓存。
+"""
+import os
+import time
+import mmap
+import fcntl
+import pickle
+import struct
+import hashlib
+import threading
+import zlib
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+MAGIC = b'DJMMAPC1'
+# magic、布局校验值、代数（clear时加一，旧代数的槽都视为空）
+HEADER = struct.Struct('<8sII')
+HEADER_SIZE = 64
+# 键的md5、代数、过期时间（0为永不过期）、最近访问时间、值长度、标志位
+SLOT = struct.Struct('<16sIddIB')
+FLAG_COMPRESSED = 1
+FLAG_PINNED = 2
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+DEFAULT_SLOT_SIZES = (256, 1024, 4096, 16384, 65536, 262144)
+PROBE_LENGTH = 8
+COMPRESS_MIN_LENGTH = 1024
+DEFAULT_PINNED_MAX_SHARE = 0.5
+
+# 本进程打开的映射：(路径, 文件大小, 进程id) -> (文件描述符, 映射, 线程锁)
+_mappings = {}
+_mappings_lock = threading.Lock()
+
+# _read读到无法解析的槽时的返回值
+MISSING = object()
+
+
+class MmapCache(BaseCache):
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._max_size = int(options.get('MAX_SIZE', DEFAULT_MAX_SIZE))
+        slot_sizes = sorted(options.get('SLOT_SIZES', DEFAULT_SLOT_SIZES))
+        self._pinned_prefixes = tuple(options.get('PINNED_KEY_PREFIXES', ()))
+        pinned_max_share = float(options.get('PINNED_MAX_SHARE', DEFAULT_PINNED_MAX_SHARE))
+
+        # 每个区域：(起始偏移, 槽数, 每个槽的总大小, 可存放的值的最大长度)
+        self._regions = []
+        offset = HEADER_SIZE
+        region_size = (self._max_size - HEADER_SIZE) // len(slot_sizes)
+        for payload_size in slot_sizes:
+            slot_size = SLOT.size + payload_size
+            count = region_size // slot_size
+            if count:
+                self._regions.append((offset, count, slot_size, payload_size))
+                offset += count * slot_size
+        self._file_size = offset
+        self._layout = zlib.crc32(repr((self._max_size, slot_sizes)).encode())
+        # 每个探测范围内最多可以有几个固定的槽
+        self._max_pinned = [max(1, int(min(PROBE_LENGTH, count) * pinned_max_share))
+                            for offset, count, slot_size, payload_size in self._regions]
+
+        self._pid = None
+        self._fd = None
+        self._mm = None
+        self._thread_lock = None
+
+    # 文件和锁
+
+    def _open(self):
+        # fork出的子进程需要重新打开文件，否则会与父进程共用同一个文件锁
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with _mappings_lock:
+            key = (self._path, self._file_size, pid)
+            if key not in _mappings:
+                _mappings[key] = self._map() + (threading.RLock(),)
+            self._fd, self._mm, self._thread_lock = _mappings[key]
+        self._pid = pid
+
+    def _map(self):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != self._file_size:
+                os.ftruncate(fd, self._file_size)
+            mm = mmap.mmap(fd, self._file_size)
+            magic, layout, generation = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or layout != self._layout:
+                # 新文件或配置变化，重新初始化
+                mm[:HEADER_SIZE] = bytes(HEADER_SIZE)
+                HEADER.pack_into(mm, 0, MAGIC, self._layout, 1)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        return fd, mm
+
+    def _locked(self, func, *args):
+        # 同一进程的线程共用文件描述符，文件锁对它们不互斥，需要先持有共用的线程锁
+        self._open()
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                return func(*args)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # 槽的读写，调用时必须已持有锁
+
+    def _generation(self):
+        return HEADER.unpack_from(self._mm, 0)[2]
+
+    def _probe(self, region, digest):
+        offset, count, slot_size, payload_size = region
+        start = int.from_bytes(digest[:8], 'little') % count
+        for i in range(min(PROBE_LENGTH, count)):
+            yield offset + (start + i) % count * slot_size
+
+    def _find(self, digest, now):
+        """返回键所在槽的偏移量，不存在或已过期时返回None"""
+        generation = self._generation()
+        for region in self._regions:
+            for slot in self._probe(region, digest):
+                slot_digest, slot_generation, expires, atime, length, flags = SLOT.unpack_from(self._mm, slot)
+                if slot_digest == digest and slot_generation == generation:
+                    if expires and expires <= now:
+                        self._free(slot)
+                        return None
+                    return slot
+        return None
+
+    def _free(self, slot):
+        SLOT.pack_into(self._mm, slot, bytes(16), 0, 0.0, 0.0, 0, 0)
+
+    def _read(self, slot, now):
+        """读取槽中的值，值无法解析时释放该槽并返回MISSING"""
+        digest, generation, expires, atime, length, flags = SLOT.unpack_from(self._mm, slot)
+        try:
+            data = self._mm[slot + SLOT.size:slot + SLOT.size + length]
+            if flags & FLAG_COMPRESSED:
+                data = zlib.decompress(data)
+            value = pickle.loads(data)
+        except Exception:
+            self._free(slot)
+            return MISSING
+        SLOT.pack_into(self._mm, slot, digest, generation, expires, now, length, flags)
+        return value
+
+    def _select(self, digest, length, now, pinned=False):
+        """
+        在所有能容纳length字节的区域中为键选择一个槽，优先使用键原来的槽、空槽或已过期的槽（小的区域优先），
+        否则淘汰其中最久未访问且没有固定的槽。
+        固定的键不能使用固定的槽已经达到上限的探测范围
+        :return: 槽的偏移量，没有可用的槽时为None
+        """
+        generation = self._generation()
+        victim = None
+        victim_atime = None
+        for region, max_pinned in zip(self._regions, self._max_pinned):
+            if region[3] < length:
+                continue
+            free = None
+            candidates = []
+            pinned_count = 0
+            for slot in self._probe(region, digest):
+                slot_digest, slot_generation, slot_expires, atime, slot_length, slot_flags = \
+                    SLOT.unpack_from(self._mm, slot)
+                if slot_generation == generation and slot_digest == digest:
+                    return slot
+                if slot_generation != generation or (slot_expires and slot_expires <= now):
+                    if free is None:
+                        free = slot
+                elif slot_flags & FLAG_PINNED:
+                    pinned_count += 1
+                else:
+                    candidates.append((atime, slot))
+            if pinned and pinned_count >= max_pinned:
+                continue
+            if free is not None:
+                return free
+            for atime, slot in candidates:
+                if victim is None or atime < victim_atime:
+                    victim, victim_atime = slot, atime
+        return victim
+
+    def _write(self, digest, value, expires, now, pinned=False):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        flags = FLAG_PINNED if pinned else 0
+        if len(data) >= COMPRESS_MIN_LENGTH:
+            compressed = zlib.compress(data)
+            if len(compressed) < len(data):
+                data, flags = compressed, flags | FLAG_COMPRESSED
+
+        old = self._find(digest, now)
+        victim = self._select(digest, len(data), now, pinned)
+        if old is not None and old != victim:
+            self._free(old)
+        if victim is None:
+            return False
+
+        # 先释放槽、写入值，最后写槽头，中途被杀死时该槽只会是空的
+        self._free(victim)
+        self._mm[victim + SLOT.size:victim + SLOT.size + len(data)] = data
+        SLOT.pack_into(self._mm, victim, digest, self._generation(), expires, now, len(data), flags)
+        return True
+
+    # 缓存接口
+
+    def _digest(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return hashlib.md5(key.encode('utf-8')).digest()
+
+    def _expires(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        return 0.0 if expires is None else expires
+
+    def is_pinned(self, key):
+        """键是否不会被淘汰"""
+        return key.startswith(self._pinned_prefixes)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        digest = self._digest(key, version)
+
+        def add():
+            now = time.time()
+            if self._find(digest, now) is not None:
+                return False
+            return self._write(digest, value, self._expires(timeout), now, self.is_pinned(key))
+        return self._locked(add)
+
+    def get(self, key, default=None, version=None):
+        digest = self._digest(key, version)
+
+        def get():
+            now = time.time()
+            slot = self._find(digest, now)
+            value = MISSING if slot is None else self._read(slot, now)
+            return default if value is MISSING else value
+        return self._locked(get)
+
+    def get_many(self, keys, version=None):
+        digests = {key: self._digest(key, version) for key in keys}
+
+        def get_many():
+            now = time.time()
+            result = {}
+            for key, digest in digests.items():
+                slot = self._find(digest, now)
+                value = MISSING if slot is None else self._read(slot, now)
+                if value is not MISSING:
+                    result[key] = value
+            return result
+        return self._locked(get_many)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        digest = self._digest(key, version)
+        pinned = self.is_pinned(key)
+        return self._locked(lambda: self._write(digest, value, self._expires(timeout), time.time(), pinned))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        digest = self._digest(key, version)
+
+        def touch():
+            slot = self._find(digest, time.time())
+            if slot is None:
+                return False
+            values = list(SLOT.unpack_from(self._mm, slot))
+            values[2] = self._expires(timeout)
+            SLOT.pack_into(self._mm, slot, *values)
+            return True
+        return self._locked(touch)
+
+    def delete(self, key, version=None):
+        digest = self._digest(key, version)
+
+        def delete():
+            slot = self._find(digest, time.time())
+            if slot is None:
+                return False
+            self._free(slot)
+            return True
+        return self._locked(delete)
+
+    def has_key(self, key, version=None):
+        digest = self._digest(key, version)
+        return self._locked(lambda: self._find(digest, time.time()) is not None)
+
+    def pop(self, key, default=None, version=None):
+        """原子地取出并删除键，键不存在时返回default"""
+        digest = self._digest(key, version)
+
+        def pop():
+            now = time.time()
+            slot = self._find(digest, now)
+            value = MISSING if slot is None else self._read(slot, now)
+            if value is MISSING:
+                return default
+            self._free(slot)
+            return value
+        return self._locked(pop)
+
+    def incr(self, key, delta=1, version=None):
+        digest = self._digest(key, version)
+
+        def incr():
+            now = time.time()
+            slot = self._find(digest, now)
+            value = MISSING if slot is None else self._read(slot, now)
+            if value is MISSING:
+                raise ValueError("Key '%s' not found" % key)
+            expires, flags = SLOT.unpack_from(self._mm, slot)[2::3]
+            value += delta
+            self._write(digest, value, expires, now, bool(flags & FLAG_PINNED))
+            return value
+        return self._locked(incr)
+
+    def clear(self):
+        def clear():
+            magic, layout, generation = HEADER.unpack_from(self._mm, 0)
+            HEADER.pack_into(self._mm, 0, magic, layout, generation % 0xFFFFFFFF + 1)
+        self._locked(clear)
+
+    def close(self, **kwargs):
+        # 每个请求结束时Django会调用close，映射由本进程的所有实例共用，需要一直保持打开
+        pass
@@ -0,0 +1,87 @@
+"""
+读取查询的执行计划，找出全表扫描和额外排序（filesort），用于检查热点查询是否用上了索引
+支持SQLite和MySQL，其他数据库可以先用is_supported判断
+"""
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+SUPPORTED_VENDORS = ('sqlite', 'mysql')
+
+
+def is_supported(using='default'):
+    return connections[using].vendor in SUPPORTED_VENDORS
+
+
+def explain(queryset):
+    """
+    返回查询的执行计划，每一行是一个dict，键为EXPLAIN结果的列名
+    SQLite的列为id、parent、notused、detail，MySQL的列为id、select_type、table、type、key、Extra等
+    """
+    sql, params = queryset.query.sql_with_params()
+    return explain_sql(sql, params, queryset.db)
+
+
+def explain_sql(sql, params=None, using='default'):
+    """返回SQL语句的执行计划，params为None时sql中的参数已经填好"""
+    connection = connections[using]
+    prefix = connection.ops.explain_query_prefix()
+    with connection.cursor() as cursor:
+        cursor.execute('%s %s' % (prefix, sql), params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def analyze_tables(*models, using='default'):
+    """更新表的统计信息，让查询优化器基于真实的数据分布选择执行计划"""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for model in models:
+            table = connection.ops.quote_name(model._meta.db_table)
+            if connection.vendor == 'mysql':
+                cursor.execute('ANALYZE TABLE %s' % table)
+            else:
+                cursor.execute('ANALYZE %s' % table)
+
+
+def find_plan_problems(queryset):
+    """检查查询的执行计划，返回发现的问题列表，没有问题时返回空列表"""
+    return check_plan(explain(queryset), connections[queryset.db].vendor)
+
+
+def find_executed_plan_problems(func, using='default'):
+    """
+    执行func，检查它实际执行的每一条查询的执行计划，用于检查模型方法、分页器等内部构造的查询
+    :return: [(SQL, 问题列表), ...]，只包含有问题的查询
+    """
+    connection = connections[using]
+    with CaptureQueriesContext(connection) as context:
+        func()
+    result = []
+    for query in context.captured_queries:
+        problems = check_plan(explain_sql(query['sql'], using=using), connection.vendor)
+        if problems:
+            result.append((query['sql'], problems))
+    return result
+
+
+def check_plan(plan, vendor):
+    """
+    SQLite：不使用索引的SCAN TABLE是全表扫描，USE TEMP B-TREE是额外的排序或分组
+    MySQL：type为ALL是全表扫描，Extra中的Using filesort是额外的排序
+    """
+    problems = []
+    for row in plan:
+        if vendor == 'sqlite':
+            detail = row['detail']
+            if detail.startswith('SCAN') and 'INDEX' not in detail:
+                problems.append('全表扫描：%s' % detail)
+            if 'TEMP B-TREE' in detail:
+                problems.append('额外排序：%s' % detail)
+        elif vendor == 'mysql':
+            if row.get('type') == 'ALL':
+                problems.append('全表扫描：%s' % row.get('table'))
+            if 'Using filesort' in (row.get('Extra') or ''):
+                problems.append('额外排序：%s' % row.get('table'))
+        else:
+            raise NotImplementedError('不支持的数据库：%s，请先用is_supported判断' % vendor)
+    return problems
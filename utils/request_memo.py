@@ -0,0 +1,11 @@
+def request_memo(request, key, factory):
+    """
+    在request对象上缓存factory()的结果，同一个请求内多次调用只计算一次
+    :param request: HttpRequest实例
+    :param key: 缓存的名称
+    :param factory: 无参数的可调用对象
+    """
+    memo = request.__dict__.setdefault('_request_memo', {})
+    if key not in memo:
+        memo[key] = factory()
+    return memo[key]